@@ -0,0 +1,147 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import time
+
+from system_operator import Operator
+
+
+def collect_input_files(paths):
+    """
+    Get input files from a list of files and directories (all *.txt files of a directory, sorted by name).
+    :param paths: a list of paths
+    :return: a list of input files
+    """
+    input_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            input_files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                                  if name.endswith(".txt") and os.path.isfile(os.path.join(path, name)))
+        else:
+            input_files.append(path)
+    return input_files
+
+
+def get_job_names(input_files):
+    """
+    Get unique names of jobs (used as names of their log directories) from input files.
+    :param input_files: a list of input files
+    :return: a list of names
+    """
+    names = []
+    for input_file in input_files:
+        name = os.path.splitext(os.path.basename(input_file))[0]
+        unique_name, i = name, 1
+        while unique_name in names:
+            i += 1
+            unique_name = f"{name}_{i}"
+        names.append(unique_name)
+    return names
+
+
+def run_job(args):
+    """
+    Run an operator for a single input file in an isolated directory (with its own log and optimizer algorithm file).
+    Used by run_batch() (also in worker processes).
+    :param args: a tuple (input file, job directory, optimizer algorithm number, dictionary of Operator parameters)
+    :return: a summary (dictionary) of the job; "error" is not None if the job failed
+    """
+    input_file, job_dir, optimizer_algorithm, operator_args = args
+    summary = {"input": input_file, "log": os.path.join(job_dir, "log.txt"), "containers": 0, "sent": 0,
+               "ships": 0, "utilization": 0.0, "time": 0.0, "throughput": 0.0, "error": None}
+    start_time = time.monotonic()
+    try:
+        operator = Operator(optimizer_algorithm_file=os.path.join(job_dir, "optimizer_algorithm.txt"),
+                            **operator_args)
+        operator.run(input_file=input_file, log_dir=job_dir, optimizer_algorithm=optimizer_algorithm,
+                     if_print=False)
+    except Exception as e:
+        summary["error"] = f"{type(e).__name__}: {e}"
+        summary["time"] = time.monotonic() - start_time
+        return summary
+    summary["time"] = time.monotonic() - start_time
+    containers_manager = operator.containers_manager
+    shipments = operator.report_generator.shipments_list
+    summary["containers"] = len(containers_manager.waiting_containers) + len(containers_manager.sent_containers)
+    summary["sent"] = len(containers_manager.sent_containers)
+    summary["ships"] = len(shipments)
+    capacity = sum(sh.ship.length * sh.ship.width * sh.levels_nr * sh.containers_height for sh in shipments)
+    occupied_volume = sum(sh.occupied_area * sh.containers_height for sh in shipments)
+    summary["utilization"] = occupied_volume / capacity if capacity > 0 else 0.0
+    summary["throughput"] = summary["sent"] / summary["time"] if summary["time"] > 0 else 0.0
+    return summary
+
+
+def write_summary(summaries, filename, time_spent):
+    """
+    Write a consolidated summary of a batch to a file and return it.
+    :param summaries: a list of summaries of jobs (see run_job())
+    :param filename: a summary file
+    :param time_spent: time of the whole batch in seconds
+    :return: a text of the summary
+    """
+    lines = [f"Batch of {len(summaries)} input files in {time_spent:.3f} s"]
+    for x in summaries:
+        if x["error"] is not None:
+            lines.append(f"\t{x['input']}: failed ({x['error']})")
+        else:
+            lines.append(f"\t{x['input']}: sent {x['sent']}/{x['containers']} containers, ships = {x['ships']}, "
+                         f"utilization = {100 * x['utilization']:.1f}%, time = {x['time']:.3f} s, "
+                         f"throughput = {x['throughput']:.1f} containers/s, log = {x['log']}")
+    succeeded = [x for x in summaries if x["error"] is None]
+    sent = sum(x["sent"] for x in succeeded)
+    lines.append(f"Succeeded: {len(succeeded)}, failed: {len(summaries) - len(succeeded)}")
+    lines.append(f"Sent {sent}/{sum(x['containers'] for x in succeeded)} containers, "
+                 f"ships = {sum(x['ships'] for x in succeeded)}")
+    if time_spent > 0:
+        lines.append(f"Throughput = {sent / time_spent:.1f} containers/s")
+    text = "\n".join(lines)
+    with open(filename, "w") as f:
+        f.write(text + "\n")
+    return text
+
+
+def run_batch(paths, output_dir="batch_log", optimizer_algorithm=1, processes=None, **operator_args):
+    """
+    Run an operator for many input files in a process pool. Every job gets its own directory in the output directory
+    (a log and an optimizer algorithm file); a consolidated summary is written to summary.txt.
+    :param paths: a list of input files and directories with input files (*.txt)
+    :param output_dir: a directory for directories of jobs and the summary
+    :param optimizer_algorithm: an optimizer algorithm number used by all jobs
+    :param processes: number of worker processes (None means the number of CPUs, 1 means no process pool)
+    :param operator_args: other parameters of Operator (e.g. time_budget); by default jobs do not start process pools
+                          of their own (workers and optimizer_workers are 1), because they already run in a pool
+    :return: a tuple (list of summaries of jobs (see run_job()), text of the consolidated summary)
+    """
+    input_files = collect_input_files(paths)
+    os.makedirs(output_dir, exist_ok=True)
+    operator_args.setdefault("workers", 1)
+    operator_args.setdefault("optimizer_workers", 1)
+    jobs = [(input_file, os.path.join(output_dir, name), optimizer_algorithm, operator_args)
+            for input_file, name in zip(input_files, get_job_names(input_files))]
+    start_time = time.monotonic()
+    if processes == 1:
+        summaries = [run_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            summaries = list(executor.map(run_job, jobs))
+    text = write_summary(summaries, os.path.join(output_dir, "summary.txt"), time.monotonic() - start_time)
+    return summaries, text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the operator for many input files in parallel.")
+    parser.add_argument("paths", nargs="+", help="input files or directories with input files (*.txt)")
+    parser.add_argument("--output-dir", default="batch_log", help="a directory for logs and the summary")
+    parser.add_argument("--algorithm", type=int, default=1, help="an optimizer algorithm number")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="optimization time budget per timestamp in seconds")
+    args = parser.parse_args()
+    _, text = run_batch(args.paths, output_dir=args.output_dir, optimizer_algorithm=args.algorithm,
+                        processes=args.processes, time_budget=args.time_budget)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -77,8 +77,10 @@ class ContainersManager:
         """
         self.waiting_containers = []    # list of containers waiting for sending
         self.sent_containers = []       # list of sent containers
+        self.dwell_times = {}           # dictionary {container id: timestamp of sending - container timestamp}
 
-        self.const_h = None
+        self.const_h = None             # height of the first container (containers of other heights form
+                                        # other height classes, see Operator.optimize())
 
         # default values defining a correct container
         self.min_length = args.get("min_length", 1)
@@ -117,25 +119,51 @@ class ContainersManager:
             if check_ok:
                 if self.const_h is None:
                     self.const_h = container.height
-                    self.waiting_containers.append(container)
-                elif container.height == self.const_h:
-                    self.waiting_containers.append(container)
-                else:
-                    container = None
+                self.waiting_containers.append(container)
             else:
                 container = None
         return container
 
-    def send(self, containers):
+    def send(self, containers, timestamp=None):
         """
         Move containers from a list of waiting containers to a list of sent containers.
         :param containers: list of containers to sent
+        :param timestamp: (optional) timestamp of sending; if given, dwell times of containers are recorded
         :return:
         """
         for container in containers:
             if container in self.waiting_containers:
                 self.waiting_containers.remove(container)
                 self.sent_containers.append(container)
+                if timestamp is not None:
+                    self.dwell_times[container.cid] = timestamp - container.timestamp
+
+    def get_dwell_time_percentile(self, percent):
+        """
+        Get a percentile of dwell times of sent containers (the nearest-rank method).
+        :param percent: a percent (0-100)
+        :return: a percentile or None if no dwell time is recorded
+        """
+        if len(self.dwell_times) == 0:
+            return None
+        values = sorted(self.dwell_times.values())
+        rank = max(1, -(-len(values) * percent // 100))
+        return values[int(rank) - 1]
+
+    def get_dwell_time_histogram(self, bins_nr=10):
+        """
+        Get a histogram of dwell times of sent containers with bins of equal width.
+        :param bins_nr: maximum number of bins
+        :return: a list of (bin start, bin end, number of containers) tuples; bins are [start, end)
+        """
+        if len(self.dwell_times) == 0:
+            return []
+        max_value = max(self.dwell_times.values())
+        bin_width = max(1, -(-(max_value + 1) // bins_nr))
+        histogram = [[i * bin_width, (i + 1) * bin_width, 0] for i in range(max_value // bin_width + 1)]
+        for value in self.dwell_times.values():
+            histogram[value // bin_width][2] += 1
+        return [tuple(x) for x in histogram]
 
     def get_containers(self, max_timestamp):
         """
@@ -0,0 +1,493 @@
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+import argparse
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+import traceback
+
+from containers_manager import Container
+from optimizer import OptimizerSelector
+from ships_manager import Ship
+from shipments_manager import ShipmentsManager, Shipment
+from system_operator import Operator
+
+AUTHKEY_VARIABLE = "CONTAINERS_AUTHKEY"     # an environment variable with an authentication key
+
+
+def get_authkey(authkey=None):
+    """
+    Get an authentication key shared by a coordinator and its workers. Connections exchange pickled data, so there is
+    no default key: it has to be given explicitly or in the environment variable CONTAINERS_AUTHKEY.
+    :param authkey: (optional) an authentication key (bytes or str)
+    :return: the authentication key (bytes)
+    """
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if not authkey:
+        raise ValueError(f"An authentication key is required (set {AUTHKEY_VARIABLE} or pass it explicitly).")
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+def _shutdown_connection(connection):
+    """
+    Shut down a socket of a connection, so a blocked read of another thread fails instead of waiting forever.
+    :param connection: a connection
+    :return:
+    """
+    try:
+        with socket.fromfd(connection.fileno(), socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def describe_batch(algorithm, seed, ships, containers, timestamp, container_height, previous_shipment=None,
+                   time_budget=None, incremental=False):
+    """
+    Create a compact description of a batch sent to a worker. Objects are replaced with tuples of their values and
+    a deadline with a time budget, because clocks of hosts differ.
+    :param algorithm: an optimizer algorithm number
+    :param seed: a seed of the optimizer
+    :param ships: a list of available ships
+    :param containers: a list of containers
+    :param timestamp: a main timestamp
+    :param container_height: constant height of containers
+    :param previous_shipment: (optional) an uncompleted shipment from the previous timestamp
+    :param time_budget: (optional) optimization time budget in seconds
+    :param incremental: (bool) if the optimizer should extend the previous shipment (see IOptimizer.extend)
+    :return: a description (dictionary)
+    """
+    return {"algorithm": algorithm,
+            "seed": seed,
+            "ships": [(s.sid, s.length, s.width, s.height, s.timestamp) for s in ships],
+            "containers": [(c.cid, c.length, c.width, c.height, c.timestamp) for c in containers],
+            "timestamp": timestamp,
+            "container_height": container_height,
+            "previous_shipment": None if previous_shipment is None else previous_shipment.describe(),
+            "time_budget": time_budget,
+            "incremental": incremental}
+
+
+def solve_batch(description):
+    """
+    Optimize a batch described by describe_batch(). Used by workers (and by a coordinator without workers).
+    :param description: a description of a batch
+    :return: a result (dictionary): "shipments" (descriptions of shipments), "statistics", "time_spent"
+    """
+    ships = [Ship(sid=sid, length=length, width=width, height=height, timestamp=timestamp)
+             for sid, length, width, height, timestamp in description["ships"]]
+    containers = [Container(cid=cid, length=length, width=width, height=height, timestamp=timestamp)
+                  for cid, length, width, height, timestamp in description["containers"]]
+    previous_shipment = None
+    if description["previous_shipment"] is not None:
+        previous_shipment = Shipment.from_description(description["previous_shipment"], {s.sid: s for s in ships},
+                                                      {c.cid: c for c in containers},
+                                                      description["container_height"])
+    optimizer = OptimizerSelector.select(description["algorithm"])
+    optimizer.seed(description["seed"])
+    start_time = time.monotonic()
+    deadline = None if description["time_budget"] is None else start_time + description["time_budget"]
+    optimize = optimizer.extend if description["incremental"] else optimizer.optimize
+    shipments_manager = optimize(ships, containers, timestamp=description["timestamp"],
+                                 container_height=description["container_height"],
+                                 previous_shipment=previous_shipment, deadline=deadline)
+    optimizer.close()
+    return {"shipments": [sh.describe() for sh in shipments_manager.shipments],
+            "statistics": optimizer.get_statistics(),
+            "time_spent": time.monotonic() - start_time}
+
+
+def build_result(result, ships, containers, timestamp, container_height, previous_shipment=None):
+    """
+    Create a shipments manager from a result of solve_batch() using the original ships and containers.
+    An unchanged previous shipment is reused as it is.
+    :param result: a result of solve_batch()
+    :param ships: a list of original ships
+    :param containers: a list of original containers
+    :param timestamp: a main timestamp
+    :param container_height: constant height of containers
+    :param previous_shipment: (optional) the original previous shipment
+    :return: a shipments manager or None if the result is not valid
+    """
+    ships_by_id = {s.sid: s for s in ships}
+    containers_by_id = {c.cid: c for c in containers}
+    previous_description = None if previous_shipment is None else previous_shipment.describe()
+    shipments_manager = ShipmentsManager(timestamp)
+    for description in result["shipments"]:
+        if previous_description is not None and tuple(description) == previous_description:
+            shipment = previous_shipment
+        else:
+            shipment = Shipment.from_description(description, ships_by_id, containers_by_id, container_height)
+        if shipment is None or not shipments_manager.check_and_add(shipment):
+            if shipment is not None and shipment is not previous_shipment:
+                shipment.release()
+            shipments_manager.release(keep=[previous_shipment])
+            return None
+    return shipments_manager
+
+
+def run_worker(address, authkey=None, name=None, fail_after=None):
+    """
+    Run a worker: connect to a coordinator and solve batches until the coordinator stops it or disconnects.
+    An error of solving a batch is sent back as a result {"error": a message}, so the worker stays alive.
+    :param address: an address (host, port) of a coordinator
+    :param authkey: (optional) an authentication key (bytes); by default read from CONTAINERS_AUTHKEY
+    :param name: (optional) a name of the worker; by default host:pid
+    :param fail_after: (optional, for testing) number of solved batches after which the worker exits
+                       without answering
+    :return: number of solved batches
+    """
+    connection = Client(tuple(address), authkey=get_authkey(authkey))
+    connection.send(name if name is not None else f"{socket.gethostname()}:{os.getpid()}")
+    solved_nr = 0
+    while True:
+        try:
+            kind, description = connection.recv()
+        except EOFError:
+            break
+        if kind == "stop" or fail_after is not None and solved_nr >= fail_after:
+            break
+        try:
+            result = solve_batch(description)
+        except Exception as error:
+            traceback.print_exc()
+            result = {"error": f"{type(error).__name__}: {error}"}
+        connection.send(result)
+        solved_nr += 1
+    connection.close()
+    return solved_nr
+
+
+class Coordinator:
+    """
+    Class used for distributing batches (see describe_batch()) to workers connected over TCP.
+    Workers connect to the coordinator at any time. A batch of a worker which disconnects (or exceeds a task timeout)
+    is reassigned to another worker; if there are no idle workers, batches are solved locally. A batch which fails
+    with an error on a worker is not reassigned, because other workers would fail the same way.
+    """
+    def __init__(self, address=("localhost", 0), authkey=None, task_timeout=None, wait_timeout=10.0,
+                 handshake_timeout=5.0):
+        """
+        Constructor. Starts listening.
+        :param address: an address (host, port) to listen on; the port 0 means any free port
+        :param authkey: (optional) an authentication key (bytes) shared with workers; by default read from
+                        CONTAINERS_AUTHKEY, the coordinator refuses to start without a key
+        :param task_timeout: (optional) maximum time of a single batch in seconds, after which a worker is dropped
+        :param wait_timeout: maximum time of waiting for the first worker in seconds (only once, by the first run());
+                             later batches are solved locally at once if there are no idle workers
+        :param handshake_timeout: maximum time of authentication and registration of a worker in seconds
+        """
+        self.authkey = get_authkey(authkey)     # an authentication key (bytes)
+        self.listener = Listener(address)       # authentication is done by _register() of every connection
+        self.address = self.listener.address    # an address (host, port) workers connect to
+        self.task_timeout = task_timeout        # maximum time of a single batch [s]
+        self.wait_timeout = wait_timeout        # maximum time of waiting for the first worker [s]
+        self.handshake_timeout = handshake_timeout  # maximum time of registration of a worker [s]
+        self.idle_workers = queue.Queue()       # (name, connection) of workers waiting for a batch
+        self.statistics = {}                    # worker name -> {"batches", "containers", "busy time", "failures",
+                                                # "errors"}
+        self.lock = threading.Lock()            # a lock of statistics
+        self.registered = threading.Event()     # set when the first worker registers
+        self.if_waited = False                  # (bool) if run() has already waited for the first worker
+        self.if_closed = False                  # (bool) if the coordinator stopped listening
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        """
+        Private method.
+        Accept connections of workers (run in a thread until the listener is closed). Every connection is registered
+        in its own thread, so a client which does not answer does not stop registrations of other workers.
+        :return:
+        """
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                if self.if_closed:
+                    break
+                continue
+            threading.Thread(target=self._register, args=(connection,), daemon=True).start()
+
+    def _register(self, connection):
+        """
+        Private method.
+        Authenticate a connection and receive a name of its worker (run in a thread). The connection is closed if
+        the authentication fails or the handshake does not finish within handshake_timeout.
+        :param connection: an accepted connection
+        :return:
+        """
+        timer = threading.Timer(self.handshake_timeout, _shutdown_connection, args=(connection,))
+        timer.start()
+        try:
+            deliver_challenge(connection, self.authkey)
+            answer_challenge(connection, self.authkey)
+            timer.cancel()
+            if not connection.poll(self.handshake_timeout):
+                raise TimeoutError
+            name = connection.recv()
+        except (OSError, EOFError, TimeoutError, multiprocessing.AuthenticationError):
+            connection.close()
+            return
+        finally:
+            timer.cancel()
+        self._get_statistics(name)
+        self.idle_workers.put((name, connection))
+        self.registered.set()
+
+    def _get_statistics(self, name):
+        """
+        Private method.
+        Get statistics of a worker, creating them for a new one.
+        :param name: a name of a worker
+        :return: a dictionary of statistics
+        """
+        with self.lock:
+            return self.statistics.setdefault(name, {"batches": 0, "containers": 0, "busy time": 0.0,
+                                                     "failures": 0, "errors": 0})
+
+    def _run_batch(self, name, connection, i, description, done):
+        """
+        Private method.
+        Send a batch to a worker and wait for its result (run in a thread).
+        :param name: a name of a worker
+        :param connection: a connection to the worker
+        :param i: an index of the batch
+        :param description: a description of the batch
+        :param done: a queue to which (name, connection or None if the worker is dropped, i, result or None if failed)
+                     is put
+        :return:
+        """
+        start_time = time.monotonic()
+        statistics = self._get_statistics(name)
+        try:
+            connection.send(("batch", description))
+            if self.task_timeout is not None and not connection.poll(self.task_timeout):
+                raise TimeoutError
+            result = connection.recv()
+        except (OSError, EOFError, TimeoutError):
+            connection.close()
+            with self.lock:
+                statistics["failures"] += 1
+            done.put((name, None, i, None))
+            return
+        if "error" in result:
+            with self.lock:
+                statistics["errors"] += 1
+            done.put((name, connection, i, None))
+            return
+        with self.lock:
+            statistics["batches"] += 1
+            statistics["containers"] += len(description["containers"])
+            statistics["busy time"] += time.monotonic() - start_time
+        done.put((name, connection, i, result))
+
+    def _solve_locally(self, description):
+        """
+        Private method.
+        Solve a batch in the coordinator process.
+        :param description: a description of the batch
+        :return: a result (see solve_batch())
+        """
+        start_time = time.monotonic()
+        result = solve_batch(description)
+        statistics = self._get_statistics("coordinator")
+        with self.lock:
+            statistics["batches"] += 1
+            statistics["containers"] += len(description["containers"])
+            statistics["busy time"] += time.monotonic() - start_time
+        return result
+
+    def run(self, descriptions):
+        """
+        Solve batches on workers.
+        :param descriptions: a list of descriptions of batches (see describe_batch())
+        :return: a list of results (see solve_batch()) in the same order; None for a batch which failed with an error
+                 on a worker
+        """
+        if not self.if_waited:
+            self.registered.wait(self.wait_timeout)
+            self.if_waited = True
+        results = [None] * len(descriptions)
+        pending = list(range(len(descriptions)))
+        done = queue.Queue()
+        running_nr = 0
+        while len(pending) > 0 or running_nr > 0:
+            while len(pending) > 0:
+                try:
+                    name, connection = self.idle_workers.get_nowait()
+                except queue.Empty:
+                    if running_nr > 0:
+                        break
+                    i = pending.pop(0)
+                    results[i] = self._solve_locally(descriptions[i])
+                    continue
+                i = pending.pop(0)
+                threading.Thread(target=self._run_batch, args=(name, connection, i, descriptions[i], done),
+                                 daemon=True).start()
+                running_nr += 1
+            if running_nr > 0:
+                name, connection, i, result = done.get()
+                running_nr -= 1
+                if connection is None:
+                    pending.append(i)
+                else:
+                    results[i] = result
+                    self.idle_workers.put((name, connection))
+        return results
+
+    def get_worker_statistics(self):
+        """
+        Get statistics of workers with throughput (containers optimized per second of busy time).
+        :return: a dictionary {worker name: statistics}
+        """
+        with self.lock:
+            statistics = {name: dict(x) for name, x in self.statistics.items()}
+        for x in statistics.values():
+            x["throughput"] = round(x["containers"] / x["busy time"], 1) if x["busy time"] > 0 else 0.0
+        return statistics
+
+    def close(self):
+        """
+        Stop idle workers and stop listening.
+        :return:
+        """
+        while True:
+            try:
+                _, connection = self.idle_workers.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                connection.send(("stop", None))
+            except OSError:
+                pass
+            connection.close()
+        self.if_closed = True
+        self.listener.close()
+
+
+class DistributedOperator(Operator):
+    """
+    Operator optimizing batches on workers of a coordinator. For every timestamp, every height class is optimized
+    with restarts (seeds 0, 1, ...) as separate batches and the best result (see ShipmentsManager.get_cost())
+    of every class is used.
+    """
+    def __init__(self, coordinator, restarts=1, **args):
+        """
+        Constructor.
+        :param coordinator: a coordinator
+        :param restarts: number of restarts (seeds) of every height class
+        :param args: other parameters of Operator
+        """
+        args.setdefault("workers", 1)
+        super().__init__(**args)
+        self.coordinator = coordinator  # a coordinator
+        self.restarts = restarts        # number of restarts of every height class
+
+    def optimize_height_classes(self, ships, containers_by_height, timestamp, uncompleted_shipments, executor):
+        batches = [(height, seed) for height in sorted(containers_by_height) for seed in range(self.restarts)]
+        descriptions = [describe_batch(self.optimizer_algorithm, seed, ships, containers_by_height[height], timestamp,
+                                       height, uncompleted_shipments.get(height), self.time_budget, self.incremental)
+                        for height, seed in batches]
+        results = {}
+        for (height, seed), result in zip(batches, self.coordinator.run(descriptions)):
+            if result is None:
+                continue
+            previous_shipment = uncompleted_shipments.get(height)
+            shipments_manager = build_result(result, ships, containers_by_height[height], timestamp, height,
+                                             previous_shipment)
+            if shipments_manager is None:
+                continue
+            if height not in results or shipments_manager.get_cost() < results[height][0].get_cost():
+                if height in results:
+                    results[height][0].release(keep=[previous_shipment])
+                statistics = dict(result["statistics"], seed=seed)
+                results[height] = (shipments_manager, statistics, result["time_spent"])
+            else:
+                shipments_manager.release(keep=[previous_shipment])
+        missing = {height: x for height, x in containers_by_height.items() if height not in results}
+        if len(missing) > 0:
+            results.update(super().optimize_height_classes(ships, missing, timestamp, uncompleted_shipments, None))
+        return results
+
+    def optimize(self, if_resumed=False):
+        super().optimize(if_resumed=if_resumed)
+        self.report_generator.log("Workers:")
+        self.report_generator.increase_indent()
+        for name, x in self.coordinator.get_worker_statistics().items():
+            self.report_generator.log(f"{name}: batches = {x['batches']}, containers = {x['containers']}, "
+                                      f"busy time = {x['busy time']:.3f} s, "
+                                      f"throughput = {x['throughput']} containers/s, failures = {x['failures']}, "
+                                      f"errors = {x['errors']}")
+        self.report_generator.decrease_indent()
+
+
+def test():
+    authkey = os.urandom(16)
+    coordinator = Coordinator(authkey=authkey, wait_timeout=5.0)
+    workers = [multiprocessing.Process(target=run_worker, args=(coordinator.address, authkey, "w1")),
+               multiprocessing.Process(target=run_worker, args=(coordinator.address, authkey, "w2", 2))]
+    for worker in workers:
+        worker.start()
+    operator = DistributedOperator(coordinator, restarts=2)
+    operator.run(input_file="input_t4.txt", optimizer_algorithm=1)
+    coordinator.close()
+    for worker in workers:
+        worker.join()
+
+
+def test2():
+    authkey = os.urandom(16)
+    ships = [Ship(sid=1, length=6, width=4, height=20, timestamp=0)]
+    containers = [Container(cid=cid, length=2, width=2, height=10, timestamp=0) for cid in range(1, 5)]
+    batch = describe_batch(1, 0, ships, containers, 0, 10)
+    failing_batch = dict(batch, ships=[])    # the optimizer fails without ships
+    coordinator = Coordinator(authkey=authkey, wait_timeout=1.0)
+    # without workers the coordinator waits for the first one only once
+    start_time = time.monotonic()
+    for _ in range(3):
+        assert len(coordinator.run([batch])[0]["shipments"]) == 1
+    assert time.monotonic() - start_time < 2.0
+    # an error of a batch is reported and the worker stays alive
+    worker = multiprocessing.Process(target=run_worker, args=(coordinator.address, authkey, "w1"))
+    worker.start()
+    assert coordinator.registered.wait(5.0)
+    assert coordinator.run([failing_batch]) == [None]
+    assert len(coordinator.run([batch])[0]["shipments"]) == 1
+    statistics = coordinator.get_worker_statistics()["w1"]
+    assert statistics["errors"] == 1 and statistics["batches"] == 1
+    coordinator.close()
+    worker.join()
+    assert worker.exitcode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed optimization: a coordinator or a worker.")
+    parser.add_argument("mode", choices=["coordinator", "worker"])
+    parser.add_argument("--host", default="localhost", help="an address of the coordinator")
+    parser.add_argument("--port", type=int, default=6000, help="a port of the coordinator")
+    parser.add_argument("--authkey", default=None,
+                        help=f"an authentication key shared by all nodes; by default ${AUTHKEY_VARIABLE}")
+    parser.add_argument("--input", default="input.txt", help="(coordinator) a file with input data")
+    parser.add_argument("--algorithm", type=int, default=None, help="(coordinator) an optimizer algorithm number")
+    parser.add_argument("--restarts", type=int, default=1, help="(coordinator) restarts of every height class")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="(coordinator) optimization time budget per timestamp in seconds")
+    args = parser.parse_args()
+    try:
+        authkey = get_authkey(args.authkey)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.mode == "worker":
+        run_worker((args.host, args.port), authkey=authkey)
+    else:
+        coordinator = Coordinator((args.host, args.port), authkey=authkey)
+        operator = DistributedOperator(coordinator, restarts=args.restarts, time_budget=args.time_budget)
+        operator.run(input_file=args.input, optimizer_algorithm=args.algorithm)
+        coordinator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,32 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import hashlib
+import json
+import math
+import os
 import random
-from shipments_manager import ShipmentsManager, Shipment, PlacedContainer, CornerPosition
+import time
+import weakref
+
+import numpy as np
+
+from containers_manager import Container
+from ships_manager import Ship
+from shipments_manager import ShipmentsManager, Shipment, PlacedContainer, CornerPosition, prepare_shared_memory
+
+
+def get_ships_lower_bound(ships, containers, container_height):
+    """
+    Get a lower bound on the number of shipments needed for containers: the summary footprint area
+    divided by the biggest ship capacity (levels number * length * width).
+    :param ships: a list of available ships
+    :param containers: a list of containers
+    :param container_height: constant height of containers
+    :return: a lower bound
+    """
+    max_capacity = max((s.height // container_height) * s.length * s.width for s in ships)
+    if max_capacity == 0:
+        return 0
+    return math.ceil(sum(c.length * c.width for c in containers) / max_capacity)
 
 
 class IOptimizer:
@@ -10,76 +37,255 @@ class IOptimizer:
         self.containers = None
         self.timestamp = None
         self.previous_shipment = None
+        self.random = random.Random()   # random numbers generator used instead of the global one
 
     @staticmethod
     def info():
         return "Abstract optimizer interface"
 
-    def optimize(self, ships, containers, timestamp, container_height, previous_shipment):
+    def seed(self, seed):
+        """
+        Seed the random numbers generator of the optimizer, so its results are reproducible.
+        :param seed: a seed (int) or None
+        :return:
+        """
+        self.random.seed(seed)
+
+    def optimize(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        """
+        Optimize. An optimizer should return a valid shipments manager quickly and, if a deadline is given,
+        keep improving it until the deadline and return the best one found.
+        :param ships: a list of available ships
+        :param containers: a list of containers to send
+        :param timestamp: a main timestamp
+        :param container_height: constant height of containers
+        :param previous_shipment: an uncompleted shipment from the previous timestamp or None
+        :param deadline: (optional) a time.monotonic() value after which the optimization should stop
+        :return: a shipments manager
+        """
         self.shipments_manager = ShipmentsManager(timestamp)
         return self.shipments_manager
 
+    def extend(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        """
+        Optimize incrementally: reuse the uncompleted shipment from the previous timestamp and place in it only
+        containers which are not in it yet. Parameters and the result are the same as in optimize().
+        By default all containers are optimized again.
+        :return: a shipments manager
+        """
+        return self.optimize(ships, containers, timestamp, container_height, previous_shipment, deadline)
+
+    def get_statistics(self):
+        """
+        Get statistics of the last optimization (e.g. counters) to report.
+        :return: a dictionary {name: value}
+        """
+        return {}
+
+    def close(self):
+        """
+        Release resources of the optimizer (e.g. worker processes). By default there are none.
+        :return:
+        """
+        pass
+
+    @staticmethod
+    def time_is_up(deadline):
+        """
+        Check if a deadline has expired.
+        :param deadline: a time.monotonic() value or None (no deadline)
+        :return: True if the deadline has expired, else False
+        """
+        return deadline is not None and time.monotonic() >= deadline
+
 
 class OptimizerSelector:
     @staticmethod
-    def select(nr=1):
+    def select(nr=1, workers=None):
         if nr == 1:
             return Optimizer1()
+        elif nr == 2:
+            return MultiStartOptimizer(Optimizer1, workers=workers)
+        elif nr == 3:
+            return LocalSearchOptimizer()
+        elif nr == 4:
+            return BranchAndBoundOptimizer()
+        elif nr == 5:
+            return TilingOptimizer()
+        elif nr == 6:
+            return AdaptiveOptimizer()
+        elif nr == 7:
+            return CachedOptimizer(Optimizer1())
         else:
             return IOptimizer()
 
     @staticmethod
     def correct_algorithms_ids():
-        return [1]
+        return [1, 2, 3, 4, 5, 6, 7]
+
+
+class FailureCache:
+    """
+    Class used for storing footprints of containers which failed to be placed on the floor (the lowest level)
+    of shipments. If a container of a footprint a x b does not fit on the floor, no container with length >= a
+    and width >= b fits there either, until something is removed from the shipment. Upper levels are not cached,
+    because a bigger container may find enough support where a smaller one does not.
+    """
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.failed = weakref.WeakKeyDictionary()   # shipment -> (removals counter, list of minimal failed footprints)
+
+    def _get_footprints(self, shipment):
+        """
+        Private method.
+        Get a list of minimal failed footprints of a shipment, cleared if something has been removed from it.
+        :param shipment: a shipment
+        :return: a list of (length, width) tuples
+        """
+        entry = self.failed.get(shipment)
+        if entry is None or entry[0] != shipment.removals_nr:
+            entry = (shipment.removals_nr, [])
+            self.failed[shipment] = entry
+        return entry[1]
+
+    def is_doomed(self, shipment, container):
+        """
+        Check if a container certainly does not fit on the floor of a shipment.
+        :param shipment: a shipment
+        :param container: a container
+        :return: True if a dominated footprint has already failed, else False
+        """
+        return any(container.length >= length and container.width >= width
+                   for length, width in self._get_footprints(shipment))
+
+    def add(self, shipment, container):
+        """
+        Add a footprint of a container which failed to be placed on the floor of a shipment.
+        :param shipment: a shipment
+        :param container: a container
+        :return:
+        """
+        footprints = self._get_footprints(shipment)
+        footprints[:] = [(length, width) for length, width in footprints
+                         if length < container.length or width < container.width]
+        footprints.append((container.length, container.width))
 
 
 class Optimizer1(IOptimizer):
     def __init__(self):
         super().__init__()
+        self.failure_cache = FailureCache()     # footprints which failed to be placed in shipments
+        self.if_quick = False                   # (bool) if only candidate corners are checked (see place_container)
 
     @staticmethod
     def info():
         return "Stupid optimizer"
 
-    def new_shipment(self):
-        ship = random.choice(self.ships)
-        shipment = Shipment(ship, containers_height=self.container_height)
+    def score_ships(self, pending_containers):
+        """
+        Score all ships against pending containers in one NumPy pass.
+        A ship is better if:
+            - more pending containers fit into it (the container length and width against the ship length and width),
+            - its capacity (levels number * length * width) is enough for all fitting containers
+              (the footprint area lower bound),
+            - it wastes less capacity if it is enough, or it has more capacity if it is not.
+        :param pending_containers: a list of containers waiting for placement
+        :return: an array of ranks of ships (0 is the best)
+        """
+        ships_dims = np.array([[s.length, s.width, s.height] for s in self.ships], dtype=np.int64)
+        levels = ships_dims[:, 2] // self.container_height
+        capacity = levels * ships_dims[:, 0] * ships_dims[:, 1]
+        if len(pending_containers) == 0:
+            return np.argsort(np.argsort(-capacity, kind="stable"), kind="stable")
+        containers_dims = np.array([[c.length, c.width] for c in pending_containers], dtype=np.int64)
+        fits = (containers_dims[np.newaxis, :, 0] <= ships_dims[:, np.newaxis, 0]) & \
+               (containers_dims[np.newaxis, :, 1] <= ships_dims[:, np.newaxis, 1]) & \
+               (levels[:, np.newaxis] > 0)
+        fits_nr = fits.sum(axis=1)
+        fits_area = fits @ (containers_dims[:, 0] * containers_dims[:, 1])
+        not_enough = capacity < fits_area
+        waste = np.where(not_enough, -capacity, capacity - fits_area)
+        order = np.lexsort((waste, not_enough, -fits_nr))
+        ranks = np.empty(len(self.ships), dtype=np.int64)
+        ranks[order] = np.arange(len(self.ships))
+        # equally scored ships get the same rank
+        keys = np.stack((-fits_nr, not_enough, waste), axis=1)[order]
+        same_as_previous = np.concatenate(([False], np.all(keys[1:] == keys[:-1], axis=1)))
+        ranks[order] = np.maximum.accumulate(np.where(same_as_previous, 0, np.arange(len(self.ships))))
+        return ranks
+
+    def new_shipment(self, pending_containers=()):
+        """
+        Create a new shipment based on the best scored ship. Ties are resolved randomly.
+        :param pending_containers: a list of containers waiting for placement
+        :return: a new shipment
+        """
+        ranks = self.score_ships(pending_containers)
+        ship = self.random.choice([s for s, rank in zip(self.ships, ranks) if rank == 0])
+        shipment = Shipment.create(ship, containers_height=self.container_height)
         return shipment
 
     def place_container(self, container, shipment):
-        for l in range(shipment.ship.length):
-            for w in range(shipment.ship.width):
-                if shipment.check_and_add(PlacedContainer(container,
-                                                          corner1=CornerPosition(length=l, width=w, height_level=0))):
-                    return True
+        """
+        Place a container in a shipment. The floor is skipped if a dominated footprint has already failed there
+        (see FailureCache). In the quick mode (set by pack() after its deadline) only candidate corners are checked
+        (see Shipment.find_candidate_position) and failures are not cached, because they are not certain
+        (neither are they in sparse shipments).
+        :param container: a container
+        :param shipment: a shipment
+        :return: True if successfully placed, else False
+        """
+        first_height_level = 1 if self.failure_cache.is_doomed(shipment, container) else 0
+        if self.if_quick:
+            corner = shipment.find_candidate_position(container, first_height_level)
+            return corner is not None and shipment.check_and_add(PlacedContainer(container, corner1=corner))
+        if self.search_position(container, shipment, first_height_level):
+            return True
+        if first_height_level == 0 and shipment.IF_EXHAUSTIVE:
+            self.failure_cache.add(shipment, container)
         return False
 
-    def optimize(self, ships, containers, timestamp, container_height, previous_shipment):
+    def search_position(self, container, shipment, first_height_level=0):
+        """
+        Search for a position of a container in a shipment and add it there.
+        :param container: a container
+        :param shipment: a shipment
+        :param first_height_level: the lowest height level which is searched
+        :return: True if successfully added, else False
         """
+        # the first correct position (the lowest height level, then length, then width), found in a vectorized way;
+        # a sparse shipment checks candidate corners instead of all cells
+        corner = shipment.find_position(container, first_height_level)
+        return corner is not None and shipment.check_and_add(PlacedContainer(container, corner1=corner))
 
-        :param ships:
-        :param containers:
-        :param timestamp:
-        :param container_height:
-        :param previous_shipment:
-        Sytuacja w której to jest użyte:
+    def pack(self, containers, deadline=None, if_abort=True):
+        """
+        Pack containers greedily in a given order.
+        Sytuacja w której używany jest previous_shipment:
         W poprzedniej turze mieliśmy duży fajny statek. Nie zapakowaliśmy go do końca, więc nie wysłaliśmy ostatniej
         partii. Teraz nie mamy już tego statku. Okazało się, że nie jesteśmy w stanie wysłać naraz zalegających
         kontenerów nowymi statkami, ale musimy to jakoś zrobić. W związku z tym wysyłamy tamten duży statek tak,
         jak mogliśmy.
-        :return:
+        :param containers: a list of containers
+        :param deadline: (optional) a deadline of packing
+        :param if_abort: (bool) if packing is aborted when the deadline expires; else the remaining containers are
+                         placed in the quick mode (see place_container()), so a first solution is always returned
+        :return: a shipments manager or None if aborted
         """
-        self.container_height = container_height
-        self.containers = containers
-        self.ships = ships
-        self.timestamp = timestamp
-        self.previous_shipment = previous_shipment
-        self.shipments_manager = ShipmentsManager(timestamp)
+        shipments_manager = ShipmentsManager(self.timestamp)
 
         use_previous_shipment = False
 
-        shipment = self.new_shipment()
-        for container in self.containers:
+        shipment = self.new_shipment(containers)
+        for i, container in enumerate(containers):
+            if not self.if_quick and self.time_is_up(deadline):
+                if if_abort:
+                    shipments_manager.release(keep=[self.previous_shipment])
+                    shipment.release()
+                    return None
+                self.if_quick = True
             if use_previous_shipment:
                 if container in self.previous_shipment.get_all_containers():
                     continue
@@ -90,11 +296,1102 @@ class Optimizer1(IOptimizer):
                     To jest właśnie ta sytuacja
                     """
                     use_previous_shipment = True
-                    self.shipments_manager.check_and_add(self.previous_shipment)
+                    shipments_manager.check_and_add(self.previous_shipment)
+                    # containers already placed in the previous shipment can not be sent twice
+                    previous_containers = self.previous_shipment.get_all_containers()
+                    placed_containers = [c for c in shipment.get_all_containers() if c not in previous_containers]
+                    shipment.release()
+                    shipment = Shipment.create(shipment.ship, containers_height=self.container_height)
+                    for placed_container in placed_containers:
+                        self.place_container(placed_container, shipment)
                 else:
-                    self.shipments_manager.check_and_add(shipment)
-                    shipment = self.new_shipment()
+                    shipments_manager.check_and_add(shipment)
+                    shipment = self.new_shipment(containers[i:])
                     self.place_container(container, shipment)
+        self.if_quick = False
+        shipments_manager.check_and_add(shipment)
+        return shipments_manager
+
+    def save_plan(self, shipments=None):
+        """
+        Save a solution as a list of (ship, placed containers) pairs. The previous shipment is saved as it is.
+        :param shipments: (optional) a list of shipments; by default shipments of the current shipments manager
+        :return: a plan
+        """
+        if shipments is None:
+            shipments = self.shipments_manager.shipments
+        return [(sh.ship, [pc for level in sh.placed_containers_levels for pc in level]) if
+                sh is not self.previous_shipment else (sh, None) for sh in shipments]
+
+    def load_plan(self, plan):
+        """
+        Create a shipments manager from a plan saved by save_plan().
+        :param plan: a plan
+        :return: a shipments manager
+        """
+        shipments_manager = ShipmentsManager(self.timestamp)
+        for ship, placed_containers in plan:
+            if placed_containers is None:
+                shipments_manager.check_and_add(ship)
+                continue
+            shipment = Shipment.create(ship, containers_height=self.container_height)
+            shipment.check_and_add_many([pc.container for pc in placed_containers],
+                                        [(pc.corner1.length, pc.corner1.width, pc.corner1.height_level)
+                                         for pc in placed_containers])
+            shipments_manager.check_and_add(shipment)
+        return shipments_manager
+
+    def shuffled_containers(self):
+        """
+        Get containers in a random order. Containers with timestamps lower than the main one stay at the beginning,
+        because only the first shipment can contain them.
+        :return: a list of containers
+        """
+        old_containers = [c for c in self.containers if c.timestamp < self.timestamp]
+        new_containers = [c for c in self.containers if c.timestamp >= self.timestamp]
+        self.random.shuffle(new_containers)
+        return old_containers + new_containers
+
+    def optimize(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        self.container_height = container_height
+        self.containers = containers
+        self.ships = ships
+        self.timestamp = timestamp
+        self.previous_shipment = previous_shipment
+
+        self.shipments_manager = self.pack(self.containers, deadline, if_abort=False)
+        lower_bound = get_ships_lower_bound(ships, containers, container_height)
+        while deadline is not None and not self.time_is_up(deadline) and \
+                len(self.shipments_manager.shipments) > lower_bound:
+            candidate = self.pack(self.shuffled_containers(), deadline)
+            if candidate is None:
+                continue
+            if candidate.get_cost() < self.shipments_manager.get_cost():
+                self.shipments_manager.release(keep=[self.previous_shipment])
+                self.shipments_manager = candidate
+            else:
+                candidate.release(keep=[self.previous_shipment])
+        return self.shipments_manager
+
+    def extend(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        """
+        Optimize incrementally: the previous shipment (with its occupancy maps) is extended in place by containers
+        which are not in it yet, and containers which do not fit are packed greedily into new shipments, so the work
+        is proportional to newly arrived containers. If the ship of the previous shipment is not available any more
+        or there are other containers with timestamps lower than the main one, all containers are optimized again.
+        :return: a shipments manager
+        """
+        if previous_shipment is None or previous_shipment.ship not in ships:
+            return self.optimize(ships, containers, timestamp, container_height, previous_shipment, deadline)
+        previous_ids = {id(c) for c in previous_shipment.get_all_containers()}
+        new_containers = [c for c in containers if id(c) not in previous_ids]
+        if any(c.timestamp < timestamp for c in new_containers):
+            return self.optimize(ships, containers, timestamp, container_height, previous_shipment, deadline)
+
+        self.container_height = container_height
+        self.containers = containers
+        self.ships = ships
+        self.timestamp = timestamp
+        self.previous_shipment = previous_shipment
+        self.shipments_manager = ShipmentsManager(timestamp)
+        shipment = previous_shipment
+        for i, container in enumerate(new_containers):
+            if not self.place_container(container, shipment):
+                self.shipments_manager.check_and_add(shipment)
+                shipment = self.new_shipment(new_containers[i:])
+                self.place_container(container, shipment)
         self.shipments_manager.check_and_add(shipment)
         return self.shipments_manager
 
+
+def _run_restart(args):
+    """
+    Run a single restart of an optimizer. Used by MultiStartOptimizer (also in worker processes).
+    A perturbed restart gets ships and containers in a random order (containers with timestamps lower than the main
+    one stay at the beginning, because only the first shipment can contain them).
+    :param args: a tuple (optimizer class, seed, if perturb, ships, containers, timestamp, container height,
+                 previous shipment, deadline)
+    :return: a shipments manager
+    """
+    optimizer_class, seed, if_perturb, ships, containers, timestamp, container_height, previous_shipment, deadline = \
+        args
+    optimizer = optimizer_class()
+    optimizer.seed(seed)
+    if if_perturb:
+        ships = list(ships)
+        optimizer.random.shuffle(ships)
+        new_containers = [c for c in containers if c.timestamp >= timestamp]
+        optimizer.random.shuffle(new_containers)
+        containers = [c for c in containers if c.timestamp < timestamp] + new_containers
+    return optimizer.optimize(ships, containers, timestamp, container_height, previous_shipment, deadline)
+
+
+class MultiStartOptimizer(IOptimizer):
+    """
+    Meta-optimizer running many seeded restarts of another optimizer in a process pool
+    and keeping the best result (the fewest shipments, then the lowest empty volume in used levels).
+    The first restart gets ships and containers in the given order, the other ones in random orders.
+    """
+    def __init__(self, optimizer_class=Optimizer1, restarts=8, workers=None, seed=0, executor=None):
+        """
+        Constructor.
+        :param optimizer_class: a class of the restarted optimizer (IOptimizer subclass)
+        :param restarts: number of restarts
+        :param workers: number of worker processes (None means the number of CPUs, 1 means no process pool)
+        :param seed: a base seed; the restart i uses the seed + i
+        :param executor: (optional) a process pool executor shared with the caller (not shut down by close());
+                         by default the optimizer creates its own one when it is needed for the first time
+        """
+        super().__init__()
+        self.optimizer_class = optimizer_class          # a class of the restarted optimizer
+        self.restarts = restarts                        # number of restarts
+        self.workers = workers or os.cpu_count() or 1   # number of worker processes
+        self.base_seed = seed                           # a base seed
+        self.executor = executor                        # a process pool executor or None
+        self.if_own_executor = False                    # (bool) if the executor was created by the optimizer
+
+    def info(self):
+        return f"Multi-start optimizer ({self.restarts} restarts of {self.optimizer_class.info()}, " \
+               f"{self.workers} workers, seed = {self.base_seed})"
+
+    def seed(self, seed):
+        self.base_seed = seed
+
+    def get_executor(self):
+        """
+        Get a process pool executor, created once and reused by all optimizations.
+        :return: a process pool executor
+        """
+        if self.executor is None:
+            prepare_shared_memory()
+            self.executor = ProcessPoolExecutor(max_workers=min(self.workers, self.restarts))
+            self.if_own_executor = True
+        return self.executor
+
+    def run_restarts(self, jobs, deadline=None):
+        """
+        Run restarts in the process pool. At most workers restarts are submitted at a time, so no restart waits
+        in a queue; after the deadline no restart is submitted (the first one is always run) and pending ones
+        are cancelled.
+        :param jobs: a list of arguments of _run_restart()
+        :param deadline: (optional) a deadline
+        :return: a list of shipments managers of finished restarts (in the order of restarts)
+        """
+        executor = self.get_executor()
+        futures = []
+        running = set()
+        for job in jobs:
+            if len(running) >= self.workers:
+                _, running = wait(running, return_when=FIRST_COMPLETED)
+            if len(futures) > 0 and self.time_is_up(deadline):
+                break
+            future = executor.submit(_run_restart, job)
+            futures.append(future)
+            running.add(future)
+        for future in running:
+            future.cancel()
+        return [future.result() for future in futures if not future.cancelled()]
+
+    def close(self):
+        if self.if_own_executor:
+            self.executor.shutdown()
+            self.executor = None
+            self.if_own_executor = False
+
+    def optimize(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        self.container_height = container_height
+        self.containers = containers
+        self.ships = ships
+        self.timestamp = timestamp
+        self.previous_shipment = previous_shipment
+
+        jobs = [(self.optimizer_class, self.base_seed + i, i > 0, ships, containers, timestamp, container_height,
+                 previous_shipment, deadline) for i in range(self.restarts)]
+        if self.workers == 1 or self.restarts == 1:
+            results = []
+            for job in jobs:
+                if len(results) > 0 and self.time_is_up(deadline):
+                    break
+                results.append(_run_restart(job))
+        else:
+            # every restart gets the previous shipment; workers read its maps from shared memory instead of copies
+            if_shared = previous_shipment is not None and previous_shipment.shared_map is None and \
+                previous_shipment.share() is not None
+            try:
+                results = self.run_restarts(jobs, deadline)
+                for result in results:
+                    result.rebind(ships, containers, previous_shipment)
+            finally:
+                if if_shared:
+                    previous_shipment.unshare()
+        # ties are resolved by the restart number, so the result depends only on the seed
+        best_nr = min(range(len(results)), key=lambda i: (results[i].get_cost(), i))
+        for i, result in enumerate(results):
+            if i != best_nr:
+                result.release(keep=[previous_shipment])
+        self.shipments_manager = results[best_nr]
+        return self.shipments_manager
+
+
+class LocalSearchOptimizer(Optimizer1):
+    """
+    Optimizer starting from a greedy solution (Optimizer1) and improving it by simulated annealing
+    with relocate, swap and re-ship moves. The objective is a number of shipments (weighted by the biggest ship
+    volume) plus the empty volume in used levels. Only containers with the main timestamp are moved
+    and the previous shipment is never changed.
+    """
+    def __init__(self, max_iterations=2000, initial_temperature=None, cooling=0.995):
+        """
+        Constructor.
+        :param max_iterations: maximum number of iterations per optimization
+        :param initial_temperature: (optional) initial temperature; by default a volume of an average container
+        :param cooling: a temperature multiplier applied after every iteration
+        """
+        super().__init__()
+        self.max_iterations = max_iterations            # maximum number of iterations per optimization
+        self.initial_temperature = initial_temperature  # initial temperature
+        self.cooling = cooling                          # a temperature multiplier applied after every iteration
+
+        self.ship_cost = 0                              # cost of a single shipment
+        self.iterations = 0                             # number of iterations of the last optimization
+        self.accepted_moves = 0                         # number of accepted moves of the last optimization
+        self.iterations_per_second = 0.0                # speed of the last optimization
+
+    def info(self):
+        return f"Local search optimizer (simulated annealing, max iterations = {self.max_iterations})"
+
+    def get_statistics(self):
+        return {"iterations": self.iterations,
+                "accepted moves": self.accepted_moves,
+                "iterations per second": round(self.iterations_per_second, 1)}
+
+    def shipment_cost(self, shipment):
+        """
+        Get a part of the objective related to a given shipment. Computed incrementally in O(levels).
+        An empty shipment (emptied by a re-ship move) costs nothing, because it is removed if the move is accepted.
+        :param shipment: a shipment
+        :return: cost
+        """
+        if shipment.occupied_area == 0:
+            return 0
+        return self.ship_cost + shipment.get_empty_volume(only_used_levels=True)
+
+    def movable_shipments(self):
+        """
+        Get shipments which can be changed (all except the previous shipment).
+        :return: a list of shipments
+        """
+        return [sh for sh in self.shipments_manager.shipments if sh is not self.previous_shipment]
+
+    def random_placed_container(self, shipment):
+        """
+        Get a random placed container with the main timestamp from a given shipment.
+        :param shipment: a shipment
+        :return: a placed container or None
+        """
+        candidates = [pc for level in shipment.placed_containers_levels for pc in level
+                      if pc.container.timestamp == self.timestamp]
+        if len(candidates) == 0:
+            return None
+        return self.random.choice(candidates)
+
+    def move_relocate(self, shipments):
+        """
+        Move a random container to another shipment.
+        :param shipments: a list of movable shipments
+        :return: a list of changed shipments or None if the move is impossible
+        """
+        source, target = self.random.sample(shipments, 2)
+        placed_container = self.random_placed_container(source)
+        if placed_container is None:
+            return None
+        source.begin()
+        target.begin()
+        if source.check_and_remove(placed_container) and self.place_container(placed_container.container, target):
+            return [source, target]
+        target.rollback()
+        source.rollback()
+        return None
+
+    def move_swap(self, shipments):
+        """
+        Swap two random containers between two shipments.
+        :param shipments: a list of movable shipments
+        :return: a list of changed shipments or None if the move is impossible
+        """
+        first, second = self.random.sample(shipments, 2)
+        first_placed = self.random_placed_container(first)
+        second_placed = self.random_placed_container(second)
+        if first_placed is None or second_placed is None:
+            return None
+        first.begin()
+        second.begin()
+        if first.check_and_remove(first_placed) and second.check_and_remove(second_placed) and \
+                self.place_container(first_placed.container, second) and \
+                self.place_container(second_placed.container, first):
+            return [first, second]
+        second.rollback()
+        first.rollback()
+        return None
+
+    def move_reship(self, shipments):
+        """
+        Try to move all containers of the least occupied shipment to other shipments.
+        The emptied shipment stays in the shipments manager (in its own transaction), so a rejected move can be
+        rolled back; it is removed by optimize() when the move is accepted.
+        :param shipments: a list of movable shipments
+        :return: a list of changed shipments (including the emptied one) or None if the move is impossible
+        """
+        removable = [sh for sh in shipments if sh is not self.shipments_manager.shipments[0]]
+        if len(removable) == 0:
+            return None
+        emptied = min(removable, key=lambda sh: sh.occupied_area)
+        others = [sh for sh in shipments if sh is not emptied]
+        emptied.begin()
+        for sh in others:
+            sh.begin()
+        if_can = True
+        # upper levels first, so removed containers never support others
+        for level in reversed(emptied.placed_containers_levels):
+            for placed_container in list(level):
+                if not any(self.place_container(placed_container.container, sh) for sh in others) or \
+                        not emptied.check_and_remove(placed_container):
+                    if_can = False
+                    break
+            if not if_can:
+                break
+        if if_can:
+            return others + [emptied]
+        for sh in others:
+            sh.rollback()
+        emptied.rollback()
+        return None
+
+    def optimize(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        self.container_height = container_height
+        self.containers = containers
+        self.ships = ships
+        self.timestamp = timestamp
+        self.previous_shipment = previous_shipment
+        self.shipments_manager = self.pack(self.containers, deadline, if_abort=False)
+
+        self.ship_cost = max(s.length * s.width * s.height for s in ships)
+        temperature = self.initial_temperature
+        if temperature is None:
+            temperature = container_height * sum(c.length * c.width for c in containers) / len(containers)
+        moves = [self.move_relocate, self.move_swap, self.move_reship]
+
+        cost = sum(self.shipment_cost(sh) for sh in self.shipments_manager.shipments)
+        best_cost = cost
+        best_plan = self.save_plan()
+        self.iterations = 0
+        self.accepted_moves = 0
+        lower_bound = get_ships_lower_bound(ships, containers, container_height)
+        start_time = time.monotonic()
+        while self.iterations < self.max_iterations and not self.time_is_up(deadline) and \
+                len(self.shipments_manager.shipments) > lower_bound:
+            shipments = self.movable_shipments()
+            if len(shipments) < 2:
+                break
+            self.iterations += 1
+            temperature *= self.cooling
+            cost_before = sum(self.shipment_cost(sh) for sh in shipments)
+            changed = self.random.choice(moves)(shipments)
+            if changed is None:
+                continue
+            delta = sum(self.shipment_cost(sh) for sh in self.movable_shipments()) - cost_before
+            if delta <= 0 or self.random.random() < math.exp(-delta / max(temperature, 1e-9)):
+                for sh in changed:
+                    sh.commit()
+                    if sh.occupied_area == 0 and self.shipments_manager.check_and_remove(sh):
+                        sh.release()
+                self.accepted_moves += 1
+                cost += delta
+                if cost < best_cost:
+                    best_cost = cost
+                    best_plan = self.save_plan()
+            else:
+                for sh in changed:
+                    sh.rollback()
+        elapsed = time.monotonic() - start_time
+        self.iterations_per_second = self.iterations / elapsed if elapsed > 0 else 0.0
+        if cost > best_cost:
+            self.shipments_manager.release(keep=[self.previous_shipment])
+            self.shipments_manager = self.load_plan(best_plan)
+        return self.shipments_manager
+
+
+class BranchAndBoundOptimizer(Optimizer1):
+    """
+    Optimizer minimizing the number of shipments for small batches by branch and bound over assignments of containers
+    to shipments (every container is put at the first correct position of its shipment, see Shipment.find_position).
+    Branches are pruned by an area lower bound; identical shapes and identical ships are not branched twice.
+    The greedy solution (Optimizer1) is the initial incumbent. Bigger batches are packed greedily.
+    The search is exhausted if neither the node limit nor the deadline stopped it. Then no assignment of containers
+    to shipments, with every container at its first correct position in the branching order, uses fewer shipments
+    than the result; it is not a bound over all packings of the batch.
+    """
+    def __init__(self, max_containers=12, max_nodes=200000):
+        """
+        Constructor.
+        :param max_containers: maximum number of containers in a batch optimized exactly
+        :param max_nodes: maximum number of visited nodes; after that the best incumbent is returned
+        """
+        super().__init__()
+        self.max_containers = max_containers    # maximum number of containers in a batch optimized exactly
+        self.max_nodes = max_nodes              # maximum number of visited nodes
+
+        self.nodes = 0                          # number of visited nodes of the last optimization
+        self.if_search_exhausted = False        # (bool) if the last search visited the whole tree
+        self.deadline = None                    # a deadline of the current optimization
+        self.ships_types = []                   # ships with distinct dimensions
+        self.max_capacity = 0                   # the biggest ship capacity (levels * length * width)
+        self.best_ships_nr = 0                  # number of shipments in the incumbent
+        self.best_plan = None                   # the incumbent plan or None if it is the greedy one
+        self.order = []                         # containers in the branching order
+
+    def info(self):
+        return f"Branch and bound optimizer (up to {self.max_containers} containers, {self.max_nodes} nodes)"
+
+    def get_statistics(self):
+        return {"nodes": self.nodes, "search exhausted": self.if_search_exhausted}
+
+    def capacity(self, ship):
+        """
+        Get a capacity of a ship (the summary area of all its height levels).
+        :param ship: a ship
+        :return: capacity
+        """
+        return (ship.height // self.container_height) * ship.length * ship.width
+
+    def lower_bound(self, shipments, i):
+        """
+        Get a lower bound on the number of shipments for a partial solution.
+        :param shipments: a list of open shipments
+        :param i: an index of the first unassigned container in the branching order
+        :return: a lower bound
+        """
+        remaining_area = sum(c.length * c.width for c in self.order[i:])
+        free_area = sum(self.capacity(sh.ship) - sh.occupied_area for sh in shipments)
+        return len(shipments) + max(0, math.ceil((remaining_area - free_area) / self.max_capacity))
+
+    def can_stop(self):
+        """
+        Check if the search must stop (node limit or deadline).
+        :return: True if the search must stop, else False
+        """
+        return self.nodes >= self.max_nodes or self.time_is_up(self.deadline)
+
+    def branch(self, shipments, i, previous_index):
+        """
+        Recursively assign containers from the index i in the branching order.
+        :param shipments: a list of open shipments
+        :param i: an index of the first unassigned container in the branching order
+        :param previous_index: an index of a shipment of the previous container
+        :return:
+        """
+        if self.can_stop():
+            return
+        self.nodes += 1
+        if i == len(self.order):
+            if len(shipments) < self.best_ships_nr:
+                self.best_ships_nr = len(shipments)
+                self.best_plan = self.save_plan(shipments)
+            return
+        if self.lower_bound(shipments, i) >= self.best_ships_nr:
+            return
+        container = self.order[i]
+        if_old = container.timestamp < self.timestamp
+        first_index = 0
+        if i > 0 and (self.order[i - 1].length, self.order[i - 1].width) == (container.length, container.width) \
+                and (self.order[i - 1].timestamp < self.timestamp) == if_old:
+            # symmetry breaking: identical shapes are assigned in non-decreasing order of shipments
+            first_index = previous_index
+        last_index = 1 if if_old else len(shipments)
+        for j in range(first_index, min(last_index, len(shipments))):
+            shipment = shipments[j]
+            shipment.begin()
+            if self.place_container(container, shipment):
+                self.branch(shipments, i + 1, j)
+            shipment.rollback()
+            if self.can_stop():
+                return
+        if (not if_old or len(shipments) == 0) and len(shipments) + 1 < self.best_ships_nr:
+            for ship in self.ships_types:
+                shipment = Shipment.create(ship, containers_height=self.container_height)
+                if self.place_container(container, shipment):
+                    self.branch(shipments + [shipment], i + 1, len(shipments))
+                shipment.release()
+                if self.can_stop():
+                    return
+
+    def optimize(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        self.container_height = container_height
+        self.containers = containers
+        self.ships = ships
+        self.timestamp = timestamp
+        self.previous_shipment = previous_shipment
+        self.deadline = deadline
+        self.shipments_manager = self.pack(self.containers, deadline, if_abort=False)
+        self.nodes = 0
+        self.if_search_exhausted = False
+        if len(containers) > self.max_containers:
+            return self.shipments_manager
+
+        self.ships_types = []
+        for ship in sorted(ships, key=self.capacity, reverse=True):
+            if all((s.length, s.width, s.height) != (ship.length, ship.width, ship.height) for s in self.ships_types):
+                self.ships_types.append(ship)
+        self.max_capacity = self.capacity(self.ships_types[0])
+        self.order = sorted(containers, key=lambda c: (c.timestamp >= timestamp, -c.length * c.width,
+                                                       -c.length, -c.width))
+        self.best_ships_nr = len(self.shipments_manager.shipments)
+        self.best_plan = None
+
+        if self.lower_bound([], 0) < self.best_ships_nr:
+            self.branch([], 0, 0)
+        self.if_search_exhausted = not self.can_stop()
+        if self.best_plan is not None:
+            self.shipments_manager.release(keep=[self.previous_shipment])
+            self.shipments_manager = self.load_plan(self.best_plan)
+        return self.shipments_manager
+
+
+class TilingOptimizer(Optimizer1):
+    """
+    Optimizer for homogeneous batches. Containers of the same shape are packed one after another
+    and each of them is put on a grid of its own shape (so identical containers form full, stable layers).
+    If the grid is full, the first correct position is used.
+    """
+    def __init__(self):
+        super().__init__()
+
+    @staticmethod
+    def info():
+        return "Tiling optimizer"
+
+    def search_position(self, container, shipment, first_height_level=0):
+        for h in range(first_height_level, shipment.levels_nr):
+            if not shipment.can_possibly_fit(container, h):
+                continue
+            for l in range(0, shipment.ship.length - container.length + 1, container.length):
+                for w in range(0, shipment.ship.width - container.width + 1, container.width):
+                    if shipment.check_and_add(PlacedContainer(container,
+                                                              corner1=CornerPosition(length=l, width=w,
+                                                                                     height_level=h))):
+                        return True
+        corner1 = shipment.find_position(container, first_height_level)
+        return corner1 is not None and shipment.check_and_add(PlacedContainer(container, corner1=corner1))
+
+    def optimize(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        self.container_height = container_height
+        self.containers = sorted(containers, key=lambda c: (c.timestamp >= timestamp, -c.length * c.width,
+                                                            c.length, c.width))
+        self.ships = ships
+        self.timestamp = timestamp
+        self.previous_shipment = previous_shipment
+        self.shipments_manager = self.pack(self.containers, deadline, if_abort=False)
+        return self.shipments_manager
+
+
+class AdaptiveOptimizer(IOptimizer):
+    """
+    Optimizer selecting another optimizer for every batch using batch features and a calibration table.
+    The table is a list of rules checked in order; the first matching rule gives an algorithm number
+    (see OptimizerSelector). A rule can contain limits: "max_containers", "min_containers", "max_shapes"
+    (distinct footprints) and "max_expected_ships" (summary footprint area / the biggest ship capacity).
+    """
+    DEFAULT_CALIBRATION_TABLE = [
+        {"max_containers": 10, "max_expected_ships": 3, "algorithm": 4},
+        {"max_shapes": 2, "algorithm": 5},
+        {"min_containers": 200, "algorithm": 1},
+        {"algorithm": 3},
+    ]
+
+    def __init__(self, calibration_table=None, calibration_file=None):
+        """
+        Constructor.
+        :param calibration_table: (optional) a list of rules; by default DEFAULT_CALIBRATION_TABLE
+        :param calibration_file: (optional) a JSON file with a list of rules (used if calibration_table is None)
+        """
+        super().__init__()
+        if calibration_table is None and calibration_file is not None:
+            with open(calibration_file, "r") as f:
+                calibration_table = json.load(f)
+        if calibration_table is None:
+            calibration_table = self.DEFAULT_CALIBRATION_TABLE
+        self.calibration_table = calibration_table  # a list of rules
+        self.optimizers = {}                        # created optimizers by algorithm numbers
+        self.selected = None                        # an optimizer selected for the last batch
+        self.features = {}                          # features of the last batch
+
+    @staticmethod
+    def info():
+        return "Adaptive optimizer (selects an optimizer for every batch)"
+
+    def get_statistics(self):
+        if self.selected is None:
+            return {}
+        statistics = {"selected": self.selected.info()}
+        statistics.update(self.features)
+        statistics.update(self.selected.get_statistics())
+        return statistics
+
+    def seed(self, seed):
+        super().seed(seed)
+        for optimizer in self.optimizers.values():
+            optimizer.seed(seed)
+
+    def close(self):
+        for optimizer in self.optimizers.values():
+            optimizer.close()
+
+    @staticmethod
+    def get_features(ships, containers, container_height):
+        """
+        Get features of a batch used for selecting an optimizer.
+        :param ships: a list of available ships
+        :param containers: a list of containers
+        :param container_height: constant height of containers
+        :return: a dictionary of features
+        """
+        max_capacity = max((s.height // container_height) * s.length * s.width for s in ships)
+        area = sum(c.length * c.width for c in containers)
+        return {"containers": len(containers),
+                "shapes": len(set((c.length, c.width) for c in containers)),
+                "expected_ships": round(area / max_capacity, 3) if max_capacity > 0 else float("inf")}
+
+    @staticmethod
+    def matches(rule, features):
+        """
+        Check if batch features match a rule of a calibration table.
+        :param rule: a rule (dictionary)
+        :param features: batch features (see get_features())
+        :return: True if the rule matches, else False
+        """
+        return features["containers"] <= rule.get("max_containers", features["containers"]) and \
+            features["containers"] >= rule.get("min_containers", features["containers"]) and \
+            features["shapes"] <= rule.get("max_shapes", features["shapes"]) and \
+            features["expected_ships"] <= rule.get("max_expected_ships", features["expected_ships"])
+
+    def select(self, features):
+        """
+        Select an optimizer for batch features.
+        :param features: batch features (see get_features())
+        :return: an optimizer
+        """
+        algorithm = 1
+        for rule in self.calibration_table:
+            if self.matches(rule, features):
+                algorithm = rule["algorithm"]
+                break
+        if algorithm not in self.optimizers:
+            self.optimizers[algorithm] = OptimizerSelector.select(algorithm)
+            self.optimizers[algorithm].random = self.random
+        return self.optimizers[algorithm]
+
+    def optimize(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        self.container_height = container_height
+        self.containers = containers
+        self.ships = ships
+        self.timestamp = timestamp
+        self.previous_shipment = previous_shipment
+        self.features = self.get_features(ships, containers, container_height)
+        self.selected = self.select(self.features)
+        self.shipments_manager = self.selected.optimize(ships, containers, timestamp, container_height,
+                                                        previous_shipment, deadline)
+        return self.shipments_manager
+
+    @staticmethod
+    def calibrate(batches, algorithms=(1, 3, 4, 5), time_weight=0.0):
+        """
+        Benchmark algorithms on sample batches and create a calibration table. Batches are grouped by the number
+        of containers; for every group the algorithm with the best summary cost is chosen
+        (the number of shipments, then the empty volume + time * time_weight, then time).
+        :param batches: a list of (ships, containers, timestamp, container height) tuples
+        :param algorithms: algorithm numbers to compare
+        :param time_weight: a weight of time in seconds compared to the empty volume
+        :return: a calibration table
+        """
+        groups = {}
+        for ships, containers, timestamp, container_height in batches:
+            size = len(containers)
+            group = groups.setdefault(size, {a: [0, 0.0, 0.0] for a in algorithms})
+            for algorithm in algorithms:
+                optimizer = OptimizerSelector.select(algorithm)
+                optimizer.seed(0)
+                start_time = time.monotonic()
+                shipments_nr, empty_volume = optimizer.optimize(ships, containers, timestamp, container_height,
+                                                                None).get_cost()
+                time_spent = time.monotonic() - start_time
+                optimizer.close()
+                group[algorithm][0] += shipments_nr
+                group[algorithm][1] += empty_volume + time_weight * time_spent
+                group[algorithm][2] += time_spent
+        table = []
+        for size in sorted(groups):
+            best = min(algorithms, key=lambda a: (groups[size][a], algorithms.index(a)))
+            if len(table) > 0 and table[-1]["algorithm"] == best:
+                table[-1]["max_containers"] = size
+            else:
+                table.append({"max_containers": size, "algorithm": best})
+        if len(table) > 0:
+            del table[-1]["max_containers"]
+        return table
+
+
+class CachedOptimizer(IOptimizer):
+    """
+    Optimizer reusing plans of identical batches. A plan is stored on disk (a JSON file in a cache directory)
+    under a canonical hash of the batch: sorted container footprints (with a flag if a container is older than
+    the main timestamp), sorted ship dimensions, containers height and the optimizer with its parameters.
+    On a hit the plan is applied to the containers of the current batch (with the same footprints) by bulk placement
+    and the optimization is skipped. The least recently used plans are removed above a limit of entries.
+    Batches with a previous shipment are not cached, neither are plans cut short by an expired deadline.
+    """
+    def __init__(self, optimizer=None, cache_dir=None, max_entries=1000, params=None):
+        """
+        Constructor.
+        :param optimizer: (optional) a wrapped optimizer; by default Optimizer1
+        :param cache_dir: (optional) a directory with plans; it is created when the first plan is stored;
+                          by default a per-user directory (see get_default_cache_dir())
+        :param max_entries: maximum number of stored plans
+        :param params: (optional) parameters of the wrapped optimizer (JSON serializable) distinguishing its plans
+        """
+        super().__init__()
+        if optimizer is None:
+            optimizer = Optimizer1()
+        if cache_dir is None:
+            cache_dir = self.get_default_cache_dir()
+        self.optimizer = optimizer          # a wrapped optimizer
+        self.cache_dir = cache_dir          # a directory with plans
+        self.max_entries = max_entries      # maximum number of stored plans
+        self.params = params                # parameters of the wrapped optimizer
+        self.hits = 0                       # number of batches served from the cache
+        self.misses = 0                     # number of optimized batches
+        self.if_hit = False                 # (bool) if the last batch was served from the cache
+
+    @staticmethod
+    def info():
+        return "Cached optimizer (reuses plans of identical batches)"
+
+    @staticmethod
+    def get_default_cache_dir():
+        """
+        Get a per-user directory with plans: containers/plans in $XDG_CACHE_HOME or in ~/.cache.
+        :return: a path
+        """
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(cache_home, "containers", "plans")
+
+    def get_statistics(self):
+        statistics = {"cache hit": self.if_hit, "cache hits": self.hits, "cache misses": self.misses}
+        if not self.if_hit:
+            statistics.update(self.optimizer.get_statistics())
+        return statistics
+
+    def seed(self, seed):
+        super().seed(seed)
+        self.optimizer.seed(seed)
+
+    def close(self):
+        self.optimizer.close()
+
+    def get_container_key(self, container):
+        """
+        Get a canonical key of a container. Containers with equal keys are interchangeable in a plan.
+        :param container: a container
+        :return: a tuple (length, width, if older than the main timestamp)
+        """
+        return container.length, container.width, container.timestamp < self.timestamp
+
+    @staticmethod
+    def get_ship_key(ship):
+        """
+        Get a canonical key of a ship. Ships with equal keys are interchangeable in a plan.
+        :param ship: a ship
+        :return: a tuple (length, width, height)
+        """
+        return ship.length, ship.width, ship.height
+
+    def get_batch_key(self, ships, containers, container_height):
+        """
+        Get a canonical hash of a batch.
+        :param ships: a list of available ships
+        :param containers: a list of containers
+        :param container_height: constant height of containers
+        :return: a hexadecimal SHA-256 digest
+        """
+        description = {"containers": sorted(self.get_container_key(c) for c in containers),
+                       "ships": sorted(self.get_ship_key(s) for s in ships),
+                       "container_height": container_height,
+                       "optimizer": type(self.optimizer).__name__,
+                       "params": self.params}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _get_path(self, key):
+        """
+        Private method.
+        Get a path of a plan file.
+        :param key: a batch key
+        :return: a path
+        """
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, key):
+        """
+        Load a plan from the cache and mark it as recently used.
+        :param key: a batch key
+        :return: a plan (a list of {"ship": ship key, "containers": [[container key, length, width, height level]]})
+                 or None
+        """
+        path = self._get_path(key)
+        try:
+            with open(path, "r") as f:
+                plan = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass    # removed by another process in the meantime
+        return plan
+
+    def store(self, key, shipments_manager):
+        """
+        Store a plan of a shipments manager in the cache and remove the least recently used plans above the limit.
+        :param key: a batch key
+        :param shipments_manager: a shipments manager
+        :return:
+        """
+        plan = [{"ship": self.get_ship_key(sh.ship),
+                 "containers": [[self.get_container_key(pc.container), pc.corner1.length, pc.corner1.width,
+                                 pc.corner1.height_level] for level in sh.placed_containers_levels for pc in level]}
+                for sh in shipments_manager.shipments]
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary_path = self._get_path(key) + f".{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(plan, f)
+        os.replace(temporary_path, self._get_path(key))
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    pass    # removed by another process in the meantime
+        if len(entries) > self.max_entries:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def apply(self, plan, ships, containers, container_height):
+        """
+        Apply a plan to ships and containers of a batch with the same canonical key.
+        :param plan: a plan (see load())
+        :param ships: a list of available ships
+        :param containers: a list of containers
+        :param container_height: constant height of containers
+        :return: a shipments manager or None if the plan does not fit the batch
+        """
+        containers_by_key = {}
+        for container in containers:
+            containers_by_key.setdefault(self.get_container_key(container), []).append(container)
+        ships_by_key = {}
+        for ship in ships:
+            ships_by_key.setdefault(self.get_ship_key(ship), ship)
+        shipments_manager = ShipmentsManager(self.timestamp)
+        for item in plan:
+            ship = ships_by_key.get(tuple(item["ship"]))
+            if ship is None:
+                shipments_manager.release()
+                return None
+            shipment = Shipment.create(ship, containers_height=container_height)
+            placed = []
+            for container_key, length, width, height_level in item["containers"]:
+                candidates = containers_by_key.get(tuple(container_key))
+                if not candidates:
+                    shipment.release()
+                    shipments_manager.release()
+                    return None
+                placed.append(candidates.pop())
+            corners = [(length, width, height_level) for _, length, width, height_level in item["containers"]]
+            if not shipment.check_and_add_many(placed, corners) or not shipments_manager.check_and_add(shipment):
+                shipment.release()
+                shipments_manager.release()
+                return None
+        if any(len(x) > 0 for x in containers_by_key.values()):
+            shipments_manager.release()
+            return None
+        return shipments_manager
+
+    def optimize(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        self.container_height = container_height
+        self.containers = containers
+        self.ships = ships
+        self.timestamp = timestamp
+        self.previous_shipment = previous_shipment
+        self.if_hit = False
+        key = None
+        if previous_shipment is None:
+            key = self.get_batch_key(ships, containers, container_height)
+            plan = self.load(key)
+            if plan is not None:
+                self.shipments_manager = self.apply(plan, ships, containers, container_height)
+                if self.shipments_manager is not None:
+                    self.if_hit = True
+                    self.hits += 1
+                    return self.shipments_manager
+        self.misses += 1
+        self.shipments_manager = self.optimizer.optimize(ships, containers, timestamp, container_height,
+                                                         previous_shipment, deadline)
+        # a plan cut short by the deadline may be worse than the one found without it
+        if key is not None and not self.time_is_up(deadline):
+            self.store(key, self.shipments_manager)
+        return self.shipments_manager
+
+    def extend(self, ships, containers, timestamp, container_height, previous_shipment, deadline=None):
+        self.if_hit = False
+        self.misses += 1
+        self.shipments_manager = self.optimizer.extend(ships, containers, timestamp, container_height,
+                                                       previous_shipment, deadline)
+        return self.shipments_manager
+
+
+def test1():
+    optimizer = LocalSearchOptimizer()
+    optimizer.container_height = 10
+    optimizer.timestamp = 39
+    optimizer.shipments_manager = ShipmentsManager(39)
+    for cid in (1, 2):
+        shipment = Shipment(Ship(sid=cid, length=5, width=5, height=20, timestamp=39), containers_height=10)
+        shipment.check_and_add(PlacedContainer(container=Container(cid=cid, length=2, width=2, height=10, timestamp=39),
+                                               corner1=CornerPosition(height_level=0, length=0, width=0)))
+        optimizer.shipments_manager.check_and_add(shipment)
+    changed = optimizer.move_reship(optimizer.movable_shipments())
+    assert changed is not None
+    # a rejected move (see LocalSearchOptimizer.optimize)
+    for shipment in changed:
+        shipment.rollback()
+    assert len(optimizer.shipments_manager.shipments) == 2
+    assert len(optimizer.shipments_manager.get_containers()) == 2
+    # an accepted move
+    changed = optimizer.move_reship(optimizer.movable_shipments())
+    for shipment in changed:
+        shipment.commit()
+        if shipment.occupied_area == 0:
+            optimizer.shipments_manager.check_and_remove(shipment)
+    assert len(optimizer.shipments_manager.shipments) == 1
+    assert len(optimizer.shipments_manager.get_containers()) == 2
+
+
+def test2():
+    optimizer = Optimizer1()
+    optimizer.container_height = 10
+    shipment = Shipment(Ship(sid=1, length=4, width=2, height=20, timestamp=39), containers_height=10)
+    assert optimizer.place_container(Container(cid=1, length=1, width=2, height=10, timestamp=39), shipment)
+    # not enough support at the upper level yet
+    assert not optimizer.place_container(Container(cid=2, length=4, width=2, height=10, timestamp=39), shipment)
+    assert optimizer.place_container(Container(cid=3, length=1, width=2, height=10, timestamp=39), shipment)
+    assert optimizer.place_container(Container(cid=2, length=4, width=2, height=10, timestamp=39), shipment)
+    # a bigger container finds enough support where a smaller one does not
+    shipment = Shipment(Ship(sid=2, length=5, width=4, height=20, timestamp=39), containers_height=10)
+    for cid, length, width in ((4, 5, 1), (5, 1, 2), (6, 3, 1)):
+        assert optimizer.place_container(Container(cid=cid, length=length, width=width, height=10, timestamp=39),
+                                         shipment)
+    assert not optimizer.place_container(Container(cid=7, length=5, width=3, height=10, timestamp=39), shipment)
+    assert optimizer.place_container(Container(cid=8, length=5, width=4, height=10, timestamp=39), shipment)
+
+
+def test3():
+    import tempfile
+    ships = [Ship(sid=1, length=6, width=4, height=20, timestamp=0)]
+    containers = [Container(cid=cid, length=2, width=2, height=10, timestamp=0) for cid in range(1, 5)]
+    table = AdaptiveOptimizer.calibrate([(ships, containers, 0, 10)], algorithms=(1, 5))
+    with tempfile.TemporaryDirectory() as dirname:
+        calibration_file = os.path.join(dirname, "calibration.json")
+        with open(calibration_file, "w") as f:
+            json.dump(table, f)
+        optimizer = AdaptiveOptimizer(calibration_file=calibration_file)
+    assert optimizer.calibration_table == table
+    assert optimizer.optimize(ships, containers, 0, 10, None).get_cost()[0] == 1
+
+
+def test4():
+    ships = [Ship(sid=sid, length=10, width=8, height=20, timestamp=0) for sid in (1, 2)]
+    containers = [Container(cid=cid, length=3 + cid % 4, width=2 + cid % 3, height=10, timestamp=0 if cid < 3 else 1)
+                  for cid in range(1, 21)]
+    previous_shipment = Shipment(ships[0], containers_height=10)
+    for container in containers[:2]:
+        previous_shipment.check_and_add(PlacedContainer(container, corner1=previous_shipment.find_position(container)))
+    costs = []
+    for workers in (1, 2):
+        optimizer = MultiStartOptimizer(restarts=4, workers=workers)
+        shipments_manager = optimizer.optimize(ships, containers, 1, 10, previous_shipment)
+        optimizer.close()
+        assert sorted(c.cid for c in shipments_manager.get_containers()) == list(range(1, 21))
+        costs.append(shipments_manager.get_cost())
+    assert costs[0] == costs[1]
+    assert previous_shipment.shared_map is None and len(previous_shipment.get_all_containers()) == 2
+
+
+def test5():
+    import tempfile
+    ships = [Ship(sid=1, length=6, width=4, height=20, timestamp=0)]
+    containers = [Container(cid=cid, length=2, width=2, height=10, timestamp=0) for cid in range(1, 5)]
+    with tempfile.TemporaryDirectory() as dirname:
+        cache_dir = os.path.join(dirname, "cache")
+        optimizer = CachedOptimizer(cache_dir=cache_dir, max_entries=1)
+        assert not os.path.exists(cache_dir)
+        optimizer.optimize(ships, containers, 0, 10, None)
+        assert os.listdir(cache_dir) == [f"{optimizer.get_batch_key(ships, containers, 10)}.json"]
+        optimizer.optimize(ships, containers[:2], 0, 10, None)
+        assert len(os.listdir(cache_dir)) == 1
+        optimizer.optimize(ships, containers[:2], 0, 10, None)
+        assert optimizer.if_hit
+        optimizer.optimize(ships, containers[:3], 0, 10, None, deadline=time.monotonic())
+        assert os.listdir(cache_dir) == [f"{optimizer.get_batch_key(ships, containers[:2], 10)}.json"]
+    with tempfile.TemporaryDirectory() as dirname:
+        os.environ["XDG_CACHE_HOME"], cache_home = dirname, os.environ.get("XDG_CACHE_HOME")
+        try:
+            assert CachedOptimizer().cache_dir == os.path.join(dirname, "containers", "plans")
+        finally:
+            if cache_home is None:
+                del os.environ["XDG_CACHE_HOME"]
+            else:
+                os.environ["XDG_CACHE_HOME"] = cache_home
+
+
+def test6():
+    ships = [Ship(sid=1, length=4, width=4, height=20, timestamp=0),
+             Ship(sid=2, length=8, width=2, height=10, timestamp=0)]
+    containers = [Container(cid=cid, length=2, width=2, height=10, timestamp=0) for cid in range(1, 11)]
+    # 40 units of footprint area, 32 units of the biggest ship capacity
+    assert get_ships_lower_bound(ships, containers, 10) == 2
+    assert get_ships_lower_bound(ships, containers[:8], 10) == 1
+    for nr in (1, 4, 5):
+        shipments_manager = OptimizerSelector.select(nr).optimize(ships, containers, 0, 10, None)
+        assert len(shipments_manager.shipments) >= get_ships_lower_bound(ships, containers, 10)
+        # the bound is reached when the first ship is filled with two full levels
+        shipments_manager = OptimizerSelector.select(nr).optimize(ships, containers[:8], 0, 10, None)
+        assert len(shipments_manager.shipments) == 1
+
+
+def test7():
+    ships = [Ship(sid=sid, length=6, width=4, height=20, timestamp=0) for sid in (1, 2)]
+    containers = [Container(cid=cid, length=2, width=2, height=10, timestamp=0 if cid < 3 else 1)
+                  for cid in range(1, 15)]
+    previous_shipment = Shipment(ships[0], containers_height=10)
+    for container in containers[:2]:
+        previous_shipment.check_and_add(PlacedContainer(container, corner1=previous_shipment.find_position(container)))
+    corners = [(x.container.cid, x.corner1) for x in previous_shipment.placed_containers_levels[0]]
+    # the previous shipment is extended in place by new containers only, the rest goes to a new shipment
+    shipments_manager = Optimizer1().extend(ships, containers, 1, 10, previous_shipment)
+    assert shipments_manager.shipments[0] is previous_shipment and len(shipments_manager.shipments) == 2
+    assert [(x.container.cid, x.corner1) for x in previous_shipment.placed_containers_levels[0][:2]] == corners
+    assert len(previous_shipment.get_all_containers()) == 12
+    assert sorted(c.cid for c in shipments_manager.get_containers()) == list(range(1, 15))
@@ -13,16 +13,18 @@ class ReportGenerator:
     """
     Class used for logging and generating report.
     """
-    def __init__(self, dirname="log", filename="log.txt", if_log_to_file=True, if_print=True):
+    def __init__(self, dirname="log", filename="log.txt", if_log_to_file=True, if_print=True, if_clear=True):
         """
         Constructor.
         :param dirname: a directory in which logs will be created
         :param filename: a basename of a file to which logs will be written
         :param if_log_to_file: (bool) if log to file
         :param if_print: (bool) if log using print
+        :param if_clear: (bool) if remove the directory with previous logs (else logs are appended, e.g. on resume)
         """
         self.if_log_to_file = if_log_to_file                # (bool) if log to file
         self.if_print = if_print                            # (bool) if log using print
+        self.if_clear = if_clear                            # (bool) if remove previous logs
         self.dirname = dirname                              # a directory in which logs will be created
         self.filename = os.path.join(dirname, filename)     # a file to which logs will be written
         self.logfile = None                                 # an opened log file
@@ -34,15 +36,16 @@ class ReportGenerator:
         self.indentation = 0                                # indentation number
 
         self.shipments_list = []                            # list of sent shipments
+        self.optimization_steps = []                        # list of (timestamp, time spent [s], budget [s], cost)
 
     def __enter__(self):
         """
         Open a log file. Used automatically at the beginning of "with".
         :return: a report generator with opened log file
         """
-        if os.path.exists(self.dirname):
+        if self.if_clear and os.path.exists(self.dirname):
             shutil.rmtree(self.dirname)
-        os.mkdir(self.dirname)
+        os.makedirs(self.dirname, exist_ok=True)
         self.logfile = open(self.filename, "a+")
         return self
 
@@ -234,6 +237,24 @@ class ReportGenerator:
         self.log(f"Optimization time = {str(delta_time)}")
         self.log(f"Finished optimization at {self.datetime2str(self.optimization_stop_datetime)}")
 
+    def optimization_step(self, timestamp, time_spent, time_budget, shipments_manager, statistics=None):
+        """
+        Log time spent on optimization of a single timestamp and quality reached.
+        :param timestamp: a main shipment timestamp
+        :param time_spent: time spent on optimization in seconds
+        :param time_budget: optimization time budget in seconds or None
+        :param shipments_manager: a shipments manager returned by an optimizer
+        :param statistics: (optional) a dictionary of optimizer statistics
+        :return:
+        """
+        cost = shipments_manager.get_cost()
+        self.optimization_steps.append((timestamp, time_spent, time_budget, cost))
+        budget_str = "" if time_budget is None else f" (budget = {time_budget:.3f} s)"
+        self.log(f"Optimized timestamp {timestamp} in {time_spent:.3f} s{budget_str}: "
+                 f"shipments = {cost[0]}, empty volume in used levels = {cost[1]}")
+        if statistics:
+            self.log(", ".join(f"{name} = {value}" for name, value in statistics.items()), additional_indent=1)
+
     @staticmethod
     def shipment2str(shipment):
         """
@@ -277,15 +298,34 @@ class ReportGenerator:
         self.decrease_indent()
         self.log("")
 
-    def generate_report(self):
+    def generate_report(self, containers_manager=None):
         """
         Generate report.
+        :param containers_manager: (optional) containers manager with dwell times of sent containers
         :return:
         """
         self.new_section()
         self.log("Report generating")
         sent_containers = sum([len(sh.get_all_containers()) for sh in self.shipments_list])
         self.log(f"Sent {sent_containers} containers.")
+        if len(self.optimization_steps) > 0:
+            times = [step[1] for step in self.optimization_steps]
+            self.log(f"Optimization time per timestamp: mean = {sum(times) / len(times):.3f} s, "
+                     f"max = {max(times):.3f} s")
+            self.increase_indent()
+            for timestamp, time_spent, time_budget, cost in self.optimization_steps:
+                over_budget = " (over budget)" if time_budget is not None and time_spent > time_budget else ""
+                self.log(f"Timestamp {timestamp}: {time_spent:.3f} s{over_budget}, "
+                         f"shipments = {cost[0]}, empty volume in used levels = {cost[1]}")
+            self.decrease_indent()
+        if containers_manager is not None and len(containers_manager.dwell_times) > 0:
+            self.log(f"Dwell time: p50 = {containers_manager.get_dwell_time_percentile(50)}, "
+                     f"p95 = {containers_manager.get_dwell_time_percentile(95)}, "
+                     f"max = {containers_manager.get_dwell_time_percentile(100)}")
+            self.increase_indent()
+            for start, end, number in containers_manager.get_dwell_time_histogram():
+                self.log(f"[{start}, {end}): {number} containers")
+            self.decrease_indent()
 
 
 def test():
@@ -1,3 +1,6 @@
+from multiprocessing import resource_tracker, shared_memory
+import pickle
+
 import numpy as np
 
 from containers_manager import Container
@@ -85,10 +88,121 @@ class PlacedContainer:
                                                       height_level=self.corner1.height_level + diff_height_level))
 
 
+class OccupancyBufferPool:
+    """
+    Class used for reusing occupancy maps of levels of released shipments. Ships come from a small fleet,
+    so maps are kept by shape.
+    """
+    def __init__(self, max_buffers_per_shape=16):
+        """
+        Constructor.
+        :param max_buffers_per_shape: maximum number of stored buffers of the same shape
+        """
+        self.max_buffers_per_shape = max_buffers_per_shape  # maximum number of stored buffers of the same shape
+        self.buffers = {}                                   # shape -> list of zeroed buffers
+        self.reused_nr = 0                                  # number of reused buffers
+        self.allocated_nr = 0                               # number of allocated buffers
+
+    def acquire(self, shape):
+        """
+        Get a zeroed occupancy map of a given shape.
+        :param shape: a shape (length, width)
+        :return: a zeroed map (np.int8)
+        """
+        buffers = self.buffers.get(shape)
+        if buffers:
+            self.reused_nr += 1
+            return buffers.pop()
+        self.allocated_nr += 1
+        return np.zeros(shape=shape, dtype=np.int8)
+
+    def release(self, buffer, if_zeroed=False):
+        """
+        Return a map to the pool.
+        :param buffer: an occupancy map
+        :param if_zeroed: (bool) if the map is already zeroed
+        :return:
+        """
+        buffers = self.buffers.setdefault(buffer.shape, [])
+        if len(buffers) < self.max_buffers_per_shape:
+            if not if_zeroed:
+                buffer[:] = 0
+            buffers.append(buffer)
+
+    def clear(self):
+        """
+        Remove all stored buffers.
+        :return:
+        """
+        self.buffers = {}
+
+
+def prepare_shared_memory():
+    """
+    Start the resource tracker of shared memory. Must be called before creating a process pool whose workers
+    receive shared shipments, so the workers use the same tracker; otherwise every worker starts its own one,
+    which reports maps attached by the worker as leaked (and frees them) when the worker exits.
+    :return:
+    """
+    resource_tracker.ensure_running()
+
+
+class SharedOccupancyMap:
+    """
+    Class used for storing an occupancy map of all levels of a shipment in shared memory.
+    It is pickled as a lightweight handle (a name and a shape), so worker processes attach to the same memory
+    instead of copying the map. Only the creating process (the owner) should change the map and unlink the memory.
+    """
+    def __init__(self, shape, name=None):
+        """
+        Constructor. Creates a zeroed map or attaches to an existing one.
+        :param shape: a shape (levels number, length, width)
+        :param name: (optional) a name of existing shared memory; if None, new memory is created
+        """
+        self.shape = tuple(shape)       # a shape (levels number, length, width)
+        self.if_owner = name is None    # (bool) if the memory was created by this object
+        self.memory = shared_memory.SharedMemory(name=name, create=self.if_owner,
+                                                 size=max(1, int(np.prod(self.shape))))
+        self.array = np.ndarray(self.shape, dtype=np.int8, buffer=self.memory.buf)   # a view of the memory
+        if self.if_owner:
+            self.array[:] = 0
+
+    def __getstate__(self):
+        """
+        Get a handle used for pickling.
+        :return: a dictionary {"name": a name of the memory, "shape": a shape}
+        """
+        return {"name": self.memory.name, "shape": self.shape}
+
+    def __setstate__(self, state):
+        """
+        Attach to the memory described by a handle.
+        :param state: a handle (see __getstate__())
+        :return:
+        """
+        self.__init__(state["shape"], name=state["name"])
+
+    def close(self):
+        """
+        Detach from the memory; the owner also frees it.
+        :return:
+        """
+        if self.memory is not None:
+            self.array = None
+            self.memory.close()
+            if self.if_owner:
+                self.memory.unlink()
+            self.memory = None
+
+
 class Shipment:
     """
     Class used for managing a single shipment.
     """
+    buffer_pool = OccupancyBufferPool()     # a pool of occupancy maps of levels shared by all shipments
+    SPARSE_MIN_AREA = 1000 * 1000   # minimum ship area (length * width) for which SparseShipment is created
+    IF_EXHAUSTIVE = True            # (bool) if find_position() checks all positions of a level
+
     def __init__(self, ship, containers_height):
         """
         Constructor.
@@ -102,10 +216,199 @@ class Shipment:
         self.placed_containers_levels = [[] for _ in range(self.levels_nr)] # list of placed containers divided into height levels
         self.all_containers = []                                            # list of all containers
 
-        self.occupancy_map = np.zeros(shape=(self.levels_nr,
-                                             self.ship.length,
-                                             self.ship.width),
-                                      dtype=np.int8)                        # map of occupancy; 0 if unoccupied, 1 if occupied
+        self.level_maps = [None] * self.levels_nr   # maps of occupancy of levels; 0 if unoccupied, 1 if occupied;
+                                                    # None if a level is empty (allocated on the first write)
+        self.occupied_area = 0                                              # summary area of placed containers
+        self.free_area = [self.ship.length * self.ship.width] * self.levels_nr  # free area of every level
+        self.free_runs = [None] * self.levels_nr    # (longest free run in the length axis, in the width axis)
+                                                    # of every level or None if not computed since the last change
+        self.supported_by = {}                      # placed container -> {placed container below: overlap area}
+        self.supporting = {}                        # placed container -> {placed container above: overlap area}
+        self.removals_nr = 0                                                # number of removed containers
+        self.journals = []                                                  # stack of undo journals of open transactions
+        self.if_journaling = True                                           # (bool) False while rolling back
+        self.shared_map = None                      # SharedOccupancyMap backing maps of levels or None
+
+    @staticmethod
+    def create(ship, containers_height):
+        """
+        Create a shipment with a backend suitable for a ship size: Shipment (dense maps of levels)
+        or SparseShipment (spatial indexes of rectangles) for very large ships.
+        :param ship: a ship (basis of a shipment)
+        :param containers_height: constant height of containers
+        :return: a new shipment
+        """
+        if ship.length * ship.width >= Shipment.SPARSE_MIN_AREA:
+            return SparseShipment(ship, containers_height)
+        return Shipment(ship, containers_height)
+
+    def describe(self):
+        """
+        Create a compact description of the shipment (used for sending it to other hosts and for checkpoints).
+        :return: a tuple (ship id, list of (container id, length, width, height level) tuples)
+        """
+        return (self.ship.sid, [(pc.container.cid, pc.corner1.length, pc.corner1.width, pc.corner1.height_level)
+                                for level in self.placed_containers_levels for pc in level])
+
+    @staticmethod
+    def from_description(description, ships_by_id, containers_by_id, containers_height):
+        """
+        Create a shipment from its compact description (see describe()).
+        :param description: a description of a shipment
+        :param ships_by_id: a dictionary {ship id: ship}
+        :param containers_by_id: a dictionary {container id: container}
+        :param containers_height: constant height of containers
+        :return: a shipment or None if the description is not valid
+        """
+        sid, placements = description
+        if sid not in ships_by_id or any(cid not in containers_by_id for cid, _, _, _ in placements):
+            return None
+        shipment = Shipment.create(ships_by_id[sid], containers_height=containers_height)
+        if not shipment.check_and_add_many([containers_by_id[cid] for cid, _, _, _ in placements],
+                                           [(length, width, height_level)
+                                            for _, length, width, height_level in placements]):
+            shipment.release()
+            return None
+        return shipment
+
+    def release(self):
+        """
+        Return maps of levels to the buffer pool. Must be called only for a discarded shipment,
+        which is not used any more.
+        :return:
+        """
+        if self.level_maps is not None:
+            for height_level, level_map in enumerate(self.level_maps):
+                if level_map is not None:
+                    self._release_level(height_level)
+            self.level_maps = None
+        if self.shared_map is not None:
+            self.shared_map.close()
+            self.shared_map = None
+
+    def share(self):
+        """
+        Move maps of levels to shared memory, so the shipment (and its map) can be sent to worker processes without
+        copying the maps. A copy received by another process copies the maps before its first change
+        (see _detach()), so only the process which shared the shipment changes the memory.
+        The memory is freed by unshare() or release().
+        :return: a shared occupancy map
+        """
+        if self.shared_map is None:
+            shared_map = SharedOccupancyMap((self.levels_nr, self.ship.length, self.ship.width))
+            for height_level, level_map in enumerate(self.level_maps):
+                if level_map is not None:
+                    shared_map.array[height_level] = level_map
+                    self._release_level(height_level)
+                    self.level_maps[height_level] = shared_map.array[height_level]
+            self.shared_map = shared_map
+        return self.shared_map
+
+    def unshare(self):
+        """
+        Move maps of levels from shared memory back to buffers of the process and detach from the memory
+        (the owner also frees it). Copies sent to other processes must not be used after the owner unshares.
+        :return:
+        """
+        if self.shared_map is None:
+            return
+        shared_map, self.shared_map = self.shared_map, None
+        for height_level, level_map in enumerate(self.level_maps or []):
+            if level_map is not None:
+                self.level_maps[height_level] = self.buffer_pool.acquire((self.ship.length, self.ship.width))
+                self.level_maps[height_level][:] = level_map
+        shared_map.close()
+
+    def _detach(self):
+        """
+        Private method.
+        Copy on write: called before every change; a copy of a shared shipment received from another process
+        stops using the memory it does not own, so its changes do not affect the shipment of the owner.
+        :return:
+        """
+        if self.shared_map is not None and not self.shared_map.if_owner:
+            self.unshare()
+
+    def __getstate__(self):
+        """
+        Get a state used for pickling. Maps of levels of a shared shipment are not copied, only a handle is.
+        :return: a state
+        """
+        state = self.__dict__.copy()
+        if self.shared_map is not None and self.level_maps is not None:
+            state["level_maps"] = [level_map is not None for level_map in self.level_maps]
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restore a pickled state. Maps of levels of a shared shipment become views of the attached shared memory.
+        :param state: a state
+        :return:
+        """
+        self.__dict__.update(state)
+        if self.shared_map is not None and self.level_maps is not None:
+            self.level_maps = [self.shared_map.array[height_level] if if_materialized else None
+                               for height_level, if_materialized in enumerate(self.level_maps)]
+
+    @property
+    def occupancy_map(self):
+        """
+        Get a dense map of occupancy of all levels (a new array, empty levels are zeros).
+        Used for reporting and saving; checks use maps of levels.
+        :return: a map of occupancy (levels number, length, width)
+        """
+        occupancy_map = np.zeros(shape=(self.levels_nr, self.ship.length, self.ship.width), dtype=np.int8)
+        for height_level, level_map in enumerate(self.level_maps):
+            if level_map is not None:
+                occupancy_map[height_level] = self.get_level_map(height_level)
+        return occupancy_map
+
+    def get_level_map(self, height_level):
+        """
+        Get a dense map of occupancy of a given level.
+        :param height_level: a height level
+        :return: a map of occupancy (length, width); a new zeroed array for an empty level
+        """
+        if self.level_maps[height_level] is None:
+            return np.zeros(shape=(self.ship.length, self.ship.width), dtype=np.int8)
+        return self.level_maps[height_level]
+
+    def get_materialized_levels_nr(self):
+        """
+        Get a number of levels with allocated maps.
+        :return: a number of levels with allocated maps
+        """
+        return sum(1 for level_map in self.level_maps if level_map is not None)
+
+    def _materialize_level(self, height_level):
+        """
+        Private method.
+        Get a map of a level, allocating it (from the buffer pool) if the level is empty.
+        :param height_level: a height level
+        :return: a map of the level
+        """
+        if self.level_maps[height_level] is None:
+            if self.shared_map is not None:
+                self.level_maps[height_level] = self.shared_map.array[height_level]
+            else:
+                self.level_maps[height_level] = self.buffer_pool.acquire((self.ship.length, self.ship.width))
+        return self.level_maps[height_level]
+
+    def _release_level(self, height_level):
+        """
+        Private method.
+        Return a map of a level to the buffer pool and mark the level as empty.
+        :param height_level: a height level
+        :return:
+        """
+        if self.shared_map is not None:
+            # only the owner may change the memory; a copy from another process just drops its view
+            if self.shared_map.if_owner:
+                self.level_maps[height_level][:] = 0
+        else:
+            self.buffer_pool.release(self.level_maps[height_level],
+                                     if_zeroed=self.free_area[height_level] == self.ship.length * self.ship.width)
+        self.level_maps[height_level] = None
 
     def to_string(self, get_list=True, get_map=True):
         """
@@ -121,8 +424,11 @@ class Shipment:
                 result += f"\n\tLevel {self.levels_nr - i - 1}: {len(level)} containers: {str(level)}"
         if get_map:
             result += "\nOccupancy map:"
-            for level in reversed(self.occupancy_map):
-                result += f"\n{str(level)}"
+            for i, level_map in enumerate(reversed(self.level_maps)):
+                if level_map is None:
+                    result += f"\n(level {self.levels_nr - i - 1} is empty)"
+                else:
+                    result += f"\n{str(level_map)}"
         return result
 
     def __str__(self):
@@ -162,7 +468,7 @@ class Shipment:
             full_volume = self.containers_height * self.get_used_levels_nr() * self.ship.length * self.ship.width
         else:
             full_volume = self.ship.height * self.ship.length * self.ship.width
-        occupied_volume = np.sum(self.occupancy_map) * self.containers_height
+        occupied_volume = self.occupied_area * self.containers_height
         return full_volume - occupied_volume
 
     def get_all_containers(self):
@@ -213,10 +519,13 @@ class Shipment:
         :return: True if if a space, a given container wants to take, is unoccupied, else False
         """
         if checked_map is None:
-            checked_map = self.occupancy_map
-        occupied_area = np.sum(checked_map[placed_container.corner1.height_level,
-                                           placed_container.corner1.length:placed_container.corner2.length,
-                                           placed_container.corner1.width:placed_container.corner2.width])
+            level_map = self.level_maps[placed_container.corner1.height_level]
+            if level_map is None:
+                return True
+        else:
+            level_map = checked_map[placed_container.corner1.height_level]
+        occupied_area = np.sum(level_map[placed_container.corner1.length:placed_container.corner2.length,
+                                         placed_container.corner1.width:placed_container.corner2.width])
         return occupied_area == 0
 
     def _check_if_stable(self, placed_container, checked_map=None):
@@ -231,59 +540,376 @@ class Shipment:
             return True
         else:
             if checked_map is None:
-                checked_map = self.occupancy_map
-            area_below = np.sum(checked_map[placed_container.corner1.height_level - 1,
-                                            placed_container.corner1.length:placed_container.corner2.length,
-                                            placed_container.corner1.width:placed_container.corner2.width])
+                level_map = self.level_maps[placed_container.corner1.height_level - 1]
+                if level_map is None:
+                    return False
+            else:
+                level_map = checked_map[placed_container.corner1.height_level - 1]
+            area_below = np.sum(level_map[placed_container.corner1.length:placed_container.corner2.length,
+                                          placed_container.corner1.width:placed_container.corner2.width])
             return area_below >= (placed_container.container.length * placed_container.container.width) / 2
 
+    @staticmethod
+    def _get_window_sums(level_map, length, width):
+        """
+        Private method.
+        Get sums of a level map in all windows of a given size using an integral image.
+        :param level_map: a 2D occupancy map of a single level
+        :param length: a window size in the length axis
+        :param width: a window size in the width axis
+        :return: a 2D array; an element [l, w] is a sum of level_map[l:l + length, w:w + width]
+        """
+        integral = np.zeros(shape=(level_map.shape[0] + 1, level_map.shape[1] + 1), dtype=np.int64)
+        integral[1:, 1:] = np.cumsum(np.cumsum(level_map, axis=0, dtype=np.int64), axis=1)
+        return integral[length:, width:] - integral[:-length, width:] - integral[length:, :-width] + \
+            integral[:-length, :-width]
+
+    @staticmethod
+    def _get_longest_run(free_map, axis):
+        """
+        Private method.
+        Get the longest run of consecutive True values in a given axis of a 2D boolean map.
+        :param free_map: a 2D boolean map
+        :param axis: an axis (0 or 1)
+        :return: the longest run length
+        """
+        counts = np.cumsum(free_map, axis=axis, dtype=np.int32)
+        resets = np.maximum.accumulate(np.where(free_map, 0, counts), axis=axis)
+        return int(np.max(counts - resets)) if counts.size > 0 else 0
+
+    def get_free_runs(self, height_level):
+        """
+        Get the longest runs of free cells at a given height level. Recomputed only after a change of the level.
+        :param height_level: a height level
+        :return: a tuple (the longest free run in the length axis, the longest free run in the width axis)
+        """
+        if self.level_maps[height_level] is None:
+            return self.ship.length, self.ship.width
+        if self.free_runs[height_level] is None:
+            free_map = self.level_maps[height_level] == 0
+            self.free_runs[height_level] = (self._get_longest_run(free_map, axis=0),
+                                            self._get_longest_run(free_map, axis=1))
+        return self.free_runs[height_level]
+
+    def can_possibly_fit(self, container, height_level):
+        """
+        Cheap necessary conditions of adding a given container at a given height level:
+            - the free area of the level is not lower than the container area,
+            - the occupied area of the level below is enough for stability,
+            - the longest free runs of the level are not shorter than the container length and width.
+        If False, the container can not be added at the level. If True, it still may not fit.
+        :param container: a container
+        :param height_level: a height level
+        :return: False if the container certainly does not fit, else True
+        """
+        area = container.length * container.width
+        if container.length > self.ship.length or container.width > self.ship.width or \
+                self.free_area[height_level] < area:
+            return False
+        if height_level > 0 and \
+                self.ship.length * self.ship.width - self.free_area[height_level - 1] < area / 2:
+            return False
+        max_length_run, max_width_run = self.get_free_runs(height_level)
+        return container.length <= max_length_run and container.width <= max_width_run
+
+    def get_free_positions(self, container, height_level):
+        """
+        Get all corner positions at a given height level at which a given container would be inside the ship,
+        would not overlap other containers and would be stable. Computed in a vectorized way.
+        :param container: a container
+        :param height_level: a height level
+        :return: a 2D boolean array; an element [l, w] is True if the corner (l, w) is correct (may be empty)
+        """
+        if not 0 <= height_level < self.levels_nr or not self.can_possibly_fit(container, height_level):
+            return np.zeros(shape=(0, 0), dtype=bool)
+        if height_level > 0 and self.level_maps[height_level - 1] is None:
+            return np.zeros(shape=(0, 0), dtype=bool)
+        if self.level_maps[height_level] is None:
+            positions = np.ones(shape=(self.ship.length - container.length + 1, self.ship.width - container.width + 1),
+                                dtype=bool)
+        else:
+            positions = self._get_window_sums(self.level_maps[height_level], container.length, container.width) == 0
+        if height_level > 0:
+            area_below = self._get_window_sums(self.level_maps[height_level - 1], container.length, container.width)
+            positions &= area_below >= (container.length * container.width) / 2
+        return positions
+
+    def find_position(self, container, first_height_level=0):
+        """
+        Find the first corner position (the lowest height level, then the lowest length, then the lowest width)
+        at which a given container can be added.
+        :param container: a container
+        :param first_height_level: the lowest height level which is searched
+        :return: a corner position or None
+        """
+        for height_level in range(first_height_level, self.levels_nr):
+            positions = np.argwhere(self.get_free_positions(container, height_level))
+            if len(positions) > 0:
+                return CornerPosition(length=int(positions[0][0]), width=int(positions[0][1]),
+                                      height_level=height_level)
+        return None
+
+    def get_candidate_corners(self, container, height_level):
+        """
+        Get candidate corner positions at a given height level (extreme points): the ship corner, points touching
+        upper edges of containers of the level and corners of containers of the level below.
+        :param container: a container
+        :param height_level: a height level
+        :return: a sorted list of (length, width) tuples
+        """
+        candidates = {(0, 0)}
+        for x in self.placed_containers_levels[height_level]:
+            candidates.add((x.corner2.length, x.corner1.width))
+            candidates.add((x.corner1.length, x.corner2.width))
+            candidates.add((x.corner2.length, 0))
+            candidates.add((0, x.corner2.width))
+        if height_level > 0:
+            for x in self.placed_containers_levels[height_level - 1]:
+                candidates.add((x.corner1.length, x.corner1.width))
+                candidates.add((x.corner2.length - container.length, x.corner1.width))
+                candidates.add((x.corner1.length, x.corner2.width - container.width))
+        return sorted((l, w) for l, w in candidates
+                      if 0 <= l <= self.ship.length - container.length and 0 <= w <= self.ship.width - container.width)
+
+    def find_candidate_position(self, container, first_height_level=0):
+        """
+        Find a corner position (the lowest height level, then the lowest length, then the lowest width) among
+        candidate corners (see get_candidate_corners) at which a given container can be added.
+        Unlike find_position it is not exhaustive, but its cost depends on the number of placed containers only.
+        :param container: a container
+        :param first_height_level: the lowest height level which is searched
+        :return: a corner position or None
+        """
+        for height_level in range(first_height_level, self.levels_nr):
+            if not self.can_possibly_fit(container, height_level) or \
+                    height_level > 0 and self.level_maps[height_level - 1] is None:
+                continue
+            for l, w in self.get_candidate_corners(container, height_level):
+                placed_container = PlacedContainer(container, CornerPosition(length=l, width=w,
+                                                                             height_level=height_level))
+                if self._check_if_unoccupied(placed_container) and self._check_if_stable(placed_container):
+                    return placed_container.corner1
+        return None
+
     @staticmethod
     def _add_to_map(placed_container, the_map):
         """
         Private method.
-        Add a given container to an occupancy map.
+        Add a given container to an occupancy map of its level.
         :param placed_container: a placed container to add
-        :param the_map: an occupancy map
+        :param the_map: an occupancy map of a level
         :return:
         """
-        the_map[placed_container.corner1.height_level,
-                placed_container.corner1.length:placed_container.corner2.length,
+        the_map[placed_container.corner1.length:placed_container.corner2.length,
                 placed_container.corner1.width:placed_container.corner2.width] = 1
 
     @staticmethod
     def _remove_from_map(placed_container, the_map):
         """
         Private method.
-        Remove a given container from an occupancy map.
+        Remove a given container from an occupancy map of its level.
         :param placed_container: a placed container to remove
-        :param the_map: an occupancy map
+        :param the_map: an occupancy map of a level
         :return:
         """
-        the_map[placed_container.corner1.height_level,
-                placed_container.corner1.length:placed_container.corner2.length,
+        the_map[placed_container.corner1.length:placed_container.corner2.length,
                 placed_container.corner1.width:placed_container.corner2.width] = 0
 
-    def _add(self, placed_container):
+    @staticmethod
+    def _get_overlap_area(placed_container1, placed_container2):
+        """
+        Private method.
+        Get an area of overlap of footprints of given containers (height levels are ignored).
+        :param placed_container1: a placed container
+        :param placed_container2: a placed container
+        :return: an overlap area
+        """
+        length = min(placed_container1.corner2.length, placed_container2.corner2.length) - \
+            max(placed_container1.corner1.length, placed_container2.corner1.length)
+        width = min(placed_container1.corner2.width, placed_container2.corner2.width) - \
+            max(placed_container1.corner1.width, placed_container2.corner1.width)
+        return max(length, 0) * max(width, 0)
+
+    def _link_supports(self, placed_container):
+        """
+        Private method.
+        Add a given container to the support graph: find containers on the level below and above it
+        and record the overlap areas.
+        :param placed_container: a placed container (already in the lists of containers)
+        :return:
+        """
+        height_level = placed_container.corner1.height_level
+        below = {}
+        if height_level > 0:
+            for x in self.placed_containers_levels[height_level - 1]:
+                area = self._get_overlap_area(placed_container, x)
+                if area > 0:
+                    below[x] = area
+                    self.supporting[x][placed_container] = area
+        above = {}
+        if height_level < self.levels_nr - 1:
+            for x in self.placed_containers_levels[height_level + 1]:
+                area = self._get_overlap_area(placed_container, x)
+                if area > 0:
+                    above[x] = area
+                    self.supported_by[x][placed_container] = area
+        self.supported_by[placed_container] = below
+        self.supporting[placed_container] = above
+
+    def _unlink_supports(self, placed_container):
+        """
+        Private method.
+        Remove a given container from the support graph.
+        :param placed_container: a placed container
+        :return:
+        """
+        for x in self.supported_by.pop(placed_container):
+            del self.supporting[x][placed_container]
+        for x in self.supporting.pop(placed_container):
+            del self.supported_by[x][placed_container]
+
+    def get_support_area(self, placed_container):
+        """
+        Get an area on which a given placed container (from the shipment) rests.
+        :param placed_container: a placed container
+        :return: a support area (a full footprint area for the lowest level)
+        """
+        if placed_container.corner1.height_level == 0:
+            return placed_container.container.length * placed_container.container.width
+        return sum(self.supported_by[placed_container].values())
+
+    def _link_supports_many(self, placed_containers):
+        """
+        Private method.
+        Add given containers to the support graph at once. Overlaps are computed in a vectorized way for every pair
+        of adjacent levels, only for pairs with at least one of the given containers.
+        :param placed_containers: a list of placed containers (already in the lists of containers, not linked)
+        :return:
+        """
+        new_ids = {id(x) for x in placed_containers}
+        heights = {x.corner1.height_level for x in placed_containers}
+        for height_level in sorted(heights | {h + 1 for h in heights if h + 1 < self.levels_nr}):
+            if height_level == 0:
+                continue
+            lower = self.placed_containers_levels[height_level - 1]
+            upper = self.placed_containers_levels[height_level]
+            if len(lower) == 0 or len(upper) == 0:
+                continue
+            lower_corners = np.array([(x.corner1.length, x.corner1.width, x.corner2.length, x.corner2.width)
+                                      for x in lower])
+            upper_corners = np.array([(x.corner1.length, x.corner1.width, x.corner2.length, x.corner2.width)
+                                      for x in upper])
+            lengths = np.minimum(lower_corners[:, None, 2], upper_corners[None, :, 2]) - \
+                np.maximum(lower_corners[:, None, 0], upper_corners[None, :, 0])
+            widths = np.minimum(lower_corners[:, None, 3], upper_corners[None, :, 3]) - \
+                np.maximum(lower_corners[:, None, 1], upper_corners[None, :, 1])
+            areas = np.maximum(lengths, 0) * np.maximum(widths, 0)
+            for i, j in zip(*np.nonzero(areas)):
+                x, y = lower[i], upper[j]
+                if id(x) in new_ids or id(y) in new_ids:
+                    area = int(areas[i, j])
+                    self.supporting[x][y] = area
+                    self.supported_by[y][x] = area
+
+    def _add(self, placed_container, level_index=None, all_index=None, if_link=True):
         """
         Private method.
         Add a given container to the occupancy map and lists of containers.
         :param placed_container: a placed container to add
+        :param level_index: (optional) an index in the list of the level at which the container is inserted
+        :param all_index: (optional) an index in the list of all containers at which the container is inserted
+        :param if_link: (bool) if add the container to the support graph; if False, _link_supports_many()
+                        must be called
         :return:
         """
-        self._add_to_map(placed_container, self.occupancy_map)
-        self.placed_containers_levels[placed_container.corner1.height_level].append(placed_container)
-        self.all_containers.append(placed_container.container)
+        self._detach()
+        self._add_to_map(placed_container, self._materialize_level(placed_container.corner1.height_level))
+        self.occupied_area += placed_container.container.length * placed_container.container.width
+        self.free_area[placed_container.corner1.height_level] -= \
+            placed_container.container.length * placed_container.container.width
+        self.free_runs[placed_container.corner1.height_level] = None
+        level = self.placed_containers_levels[placed_container.corner1.height_level]
+        if level_index is None:
+            level.append(placed_container)
+            self.all_containers.append(placed_container.container)
+        else:
+            level.insert(level_index, placed_container)
+            self.all_containers.insert(all_index, placed_container.container)
+        if if_link:
+            self._link_supports(placed_container)
+        else:
+            self.supported_by[placed_container] = {}
+            self.supporting[placed_container] = {}
+        if self.journals and self.if_journaling:
+            self.journals[-1].append(("add", placed_container))
 
-    def _remove(self, placed_container):
+    def _remove(self, placed_container, level_index=None, all_index=None):
         """
         Private method.
         Remove a given container from the occupancy map and lists of containers.
         :param placed_container: a placed container to remove
+        :param level_index: (optional) an index of the container in the list of its level
+        :param all_index: (optional) an index of the container in the list of all containers
+        :return:
+        """
+        self._detach()
+        height_level = placed_container.corner1.height_level
+        self._remove_from_map(placed_container, self.level_maps[height_level])
+        self.removals_nr += 1
+        self.occupied_area -= placed_container.container.length * placed_container.container.width
+        self.free_area[placed_container.corner1.height_level] += \
+            placed_container.container.length * placed_container.container.width
+        self.free_runs[placed_container.corner1.height_level] = None
+        if self.free_area[height_level] == self.ship.length * self.ship.width:
+            self._release_level(height_level)
+        level = self.placed_containers_levels[placed_container.corner1.height_level]
+        if level_index is None:
+            level_index = level.index(placed_container)
+            all_index = self.all_containers.index(placed_container.container)
+        del level[level_index]
+        del self.all_containers[all_index]
+        self._unlink_supports(placed_container)
+        if self.journals and self.if_journaling:
+            self.journals[-1].append(("remove", placed_container, level_index, all_index))
+
+    def begin(self):
+        """
+        Begin a transaction. Transactions can be nested.
+        All changes made until commit() or rollback() are recorded in an undo journal.
         :return:
         """
-        self._remove_from_map(placed_container, self.occupancy_map)
-        self.placed_containers_levels[placed_container.corner1.height_level].remove(placed_container)
-        self.all_containers.remove(placed_container.container)
+        self.journals.append([])
+
+    def commit(self):
+        """
+        Commit the innermost transaction. Its changes are kept (and can be still undone by rollback of an outer one).
+        :return: True if committed, False if there is no open transaction
+        """
+        if len(self.journals) == 0:
+            return False
+        journal = self.journals.pop()
+        if len(self.journals) > 0:
+            self.journals[-1].extend(journal)
+        return True
+
+    def rollback(self):
+        """
+        Undo all changes made in the innermost transaction and close it.
+        Cost is proportional to the number of changes, not to the ship size.
+        :return: True if rolled back, False if there is no open transaction
+        """
+        if len(self.journals) == 0:
+            return False
+        journal = self.journals.pop()
+        self.if_journaling = False
+        for entry in reversed(journal):
+            if entry[0] == "add":
+                # an added container is always the last one when its addition is undone
+                self._remove(entry[1], level_index=-1, all_index=-1)
+            else:
+                self._add(entry[1], level_index=entry[2], all_index=entry[3])
+        self.if_journaling = True
+        return True
 
     def check_and_add(self, placed_container):
         """
@@ -305,6 +931,141 @@ class Shipment:
             self._add(placed_container)
         return if_can
 
+    @staticmethod
+    def _get_rectangles_sums(integral, l1, w1, l2, w2):
+        """
+        Private method.
+        Get sums of a map in given rectangles using its integral image.
+        :param integral: an integral image of a map (one row and one column of zeros added at the beginning)
+        :param l1: an array of lower corners in the length axis
+        :param w1: an array of lower corners in the width axis
+        :param l2: an array of upper corners in the length axis (exclusive)
+        :param w2: an array of upper corners in the width axis (exclusive)
+        :return: an array of sums
+        """
+        return integral[l2, w2] - integral[l1, w2] - integral[l2, w1] + integral[l1, w1]
+
+    def _get_batch_levels(self, l1, w1, l2, w2, h):
+        """
+        Private method.
+        Get occupancy counts of given rectangles at every height level they are on, using difference arrays.
+        :param l1: an array of lower corners in the length axis
+        :param w1: an array of lower corners in the width axis
+        :param l2: an array of upper corners in the length axis (exclusive)
+        :param w2: an array of upper corners in the width axis (exclusive)
+        :param h: an array of height levels
+        :return: a dictionary {height level: a map of counts (length, width)}
+        """
+        counts = {}
+        for height_level in np.unique(h):
+            mask = h == height_level
+            diff = np.zeros(shape=(self.ship.length + 1, self.ship.width + 1), dtype=np.int32)
+            np.add.at(diff, (l1[mask], w1[mask]), 1)
+            np.add.at(diff, (l2[mask], w1[mask]), -1)
+            np.add.at(diff, (l1[mask], w2[mask]), -1)
+            np.add.at(diff, (l2[mask], w2[mask]), 1)
+            counts[int(height_level)] = np.cumsum(np.cumsum(diff, axis=0), axis=1)[:-1, :-1]
+        return counts
+
+    def _check_if_new(self, containers):
+        """
+        Private method.
+        Check if given containers are not in the shipment and do not repeat, using a single set of ids
+        (built once, so the cost is linear).
+        :param containers: a list of containers
+        :return: True if all containers are new, else False
+        """
+        containers_ids = {id(c) for c in self.all_containers}
+        for container in containers:
+            if id(container) in containers_ids:
+                return False
+            containers_ids.add(id(container))
+        return True
+
+    def check_and_add_many(self, containers, corners):
+        """
+        Check if all given containers can be added at given positions and if so, add them.
+        All containers are added or none of them (like check_and_join). Conditions are the same as in check_and_add(),
+        but they are checked in a vectorized way for the whole batch: containers of the batch must not overlap each
+        other, may be supported by containers of the batch and must not repeat.
+        :param containers: a list of containers
+        :param corners: an array-like (containers number, 3) of corner positions (length, width, height level)
+        :return: True if successfully added, else False
+        """
+        if len(containers) == 0:
+            return True
+        corners = np.asarray(corners, dtype=np.int64).reshape(-1, 3)
+        if len(corners) != len(containers) or not self._check_if_new(containers):
+            return False
+        l1, w1, h = corners[:, 0], corners[:, 1], corners[:, 2]
+        lengths = np.array([c.length for c in containers], dtype=np.int64)
+        widths = np.array([c.width for c in containers], dtype=np.int64)
+        l2, w2 = l1 + lengths, w1 + widths
+        if not (np.all((0 <= h) & (h < self.levels_nr)) and np.all(l1 >= 0) and np.all(w1 >= 0) and
+                np.all(l2 <= self.ship.length) and np.all(w2 <= self.ship.width)):
+            return False
+
+        batch_levels = self._get_batch_levels(l1, w1, l2, w2, h)
+        full_levels = {}    # height level -> a map of the level with the batch
+        for height_level, counts in batch_levels.items():
+            if self.level_maps[height_level] is not None:
+                counts = counts + self.get_level_map(height_level)
+            if np.any(counts > 1):
+                return False
+            full_levels[height_level] = counts
+
+        for height_level in batch_levels:
+            if height_level == 0:
+                continue
+            mask = h == height_level
+            if height_level - 1 in full_levels:
+                below = full_levels[height_level - 1]
+            elif self.level_maps[height_level - 1] is not None:
+                below = self.get_level_map(height_level - 1)
+            else:
+                return False
+            integral = np.zeros(shape=(self.ship.length + 1, self.ship.width + 1), dtype=np.int64)
+            integral[1:, 1:] = np.cumsum(np.cumsum(below, axis=0, dtype=np.int64), axis=1)
+            area_below = self._get_rectangles_sums(integral, l1[mask], w1[mask], l2[mask], w2[mask])
+            if np.any(2 * area_below < lengths[mask] * widths[mask]):
+                return False
+
+        placed_containers = [PlacedContainer(containers[i], corner1=CornerPosition(length=int(l1[i]), width=int(w1[i]),
+                                                                                   height_level=int(h[i])))
+                             for i in np.argsort(h, kind="stable")]
+        for placed_container in placed_containers:
+            self._add(placed_container, if_link=False)
+        self._link_supports_many(placed_containers)
+        return True
+
+    def _check_join(self, shipment):
+        """
+        Private method.
+        Check if all containers from the given shipment can be put above used height levels of this shipment
+        (see check_and_join). Only containers of the lowest level of the joined shipment need a stability check,
+        the others rest on the same containers as in the joined shipment.
+        :param shipment: a joined shipment
+        :return: True if the shipment can be joined, else False
+        """
+        if self.ship != shipment.ship:
+            return False
+        used_levels_nr = self.get_used_levels_nr()
+        if used_levels_nr + shipment.get_used_levels_nr() > self.levels_nr:
+            return False
+        if not self._check_if_new(shipment.all_containers):
+            return False
+        lowest_level = shipment.placed_containers_levels[0]
+        if used_levels_nr == 0 or len(lowest_level) == 0:
+            return True
+        corners = np.array([(x.corner1.length, x.corner1.width, x.corner2.length, x.corner2.width)
+                            for x in lowest_level])
+        below = self.get_level_map(used_levels_nr - 1)
+        integral = np.zeros(shape=(self.ship.length + 1, self.ship.width + 1), dtype=np.int64)
+        integral[1:, 1:] = np.cumsum(np.cumsum(below, axis=0, dtype=np.int64), axis=1)
+        area_below = self._get_rectangles_sums(integral, corners[:, 0], corners[:, 1], corners[:, 2], corners[:, 3])
+        areas = (corners[:, 2] - corners[:, 0]) * (corners[:, 3] - corners[:, 1])
+        return bool(np.all(2 * area_below >= areas))
+
     def check_and_join(self, shipment):
         """
         Check if all containers from the given shipment can be added to this shipment and if so, add it.
@@ -315,31 +1076,36 @@ class Shipment:
             - sum of used height levels in both shipments is less than or equal to the maximum number of height levels for the ship
             - every container will be stable,
             - no container from the joined shipment is in this shipment (redundancy is forbidden).
+        Maps of used levels of the joined shipment are copied as a whole and checks are vectorized;
+        only the support graph is linked container by container.
         :param shipment: a joined shipment
         :return: True if successfully added, else False
         """
-        if_can = False
-        placed_containers_to_add = []
-        if self.ship == shipment.ship:
-            used_levels_nr = self.get_used_levels_nr()
-            if used_levels_nr + shipment.get_used_levels_nr() <= self.levels_nr:
-                if_can = True
-                for level in shipment.placed_containers_levels:
-                    if not if_can:
-                        break
-                    for placed_container in level:
-                        new_placed_container = placed_container.get_shifted_copy(diff_height_level=used_levels_nr)
-                        if_can_new = self._check_if_stable(placed_container) and \
-                                     self._check_redundancy(placed_container)
-                        if if_can_new:
-                            placed_containers_to_add.append(new_placed_container)
-                        else:
-                            if_can = False
-                            break
-        if if_can:
-            for placed_container in placed_containers_to_add:
-                self._add(placed_container)
-        return if_can
+        if not self._check_join(shipment):
+            return False
+        self._detach()
+        used_levels_nr = self.get_used_levels_nr()
+        joined_levels_nr = shipment.get_used_levels_nr()
+        new_placed_containers = []
+        for k in range(joined_levels_nr):
+            height_level = used_levels_nr + k
+            level_map = self._materialize_level(height_level)
+            level_map[:] = shipment.get_level_map(k)
+            self.free_area[height_level] = shipment.free_area[k]
+            self.free_runs[height_level] = shipment.free_runs[k]
+            level = [x.get_shifted_copy(diff_height_level=used_levels_nr)
+                     for x in shipment.placed_containers_levels[k]]
+            self.placed_containers_levels[height_level].extend(level)
+            new_placed_containers.extend(level)
+        for placed_container in new_placed_containers:
+            self.all_containers.append(placed_container.container)
+            self.supported_by[placed_container] = {}
+            self.supporting[placed_container] = {}
+            if self.journals and self.if_journaling:
+                self.journals[-1].append(("add", placed_container))
+        self.occupied_area += shipment.occupied_area
+        self._link_supports_many(new_placed_containers)
+        return True
 
     def _get_supported_containers(self, placed_container):
         """
@@ -348,15 +1114,8 @@ class Shipment:
         :param placed_container: a placed container
         :return: list of containers
         """
-        if placed_container.corner1.height_level >= self.levels_nr - 1:
-            return []
-        else:
-            above_containers = self.placed_containers_levels[placed_container.corner1.height_level + 1]
-            if len(above_containers) == 0:
-                return []
-            map_to_be = np.copy(self.occupancy_map)
-            self._remove_from_map(placed_container, map_to_be)
-            return [x for x in above_containers if not self._check_if_stable(x, checked_map=map_to_be)]
+        return [x for x, area in self.supporting[placed_container].items()
+                if self.get_support_area(x) - area < (x.container.length * x.container.width) / 2]
 
     def check_and_remove(self, placed_container):
         """
@@ -385,6 +1144,273 @@ class Shipment:
         return True
 
 
+class RectangleIndex:
+    """
+    Class used for indexing placed containers of a single level by their footprints (rectangles).
+    The level is divided into square buckets and every rectangle is stored in all buckets it overlaps,
+    so memory is proportional to the number of containers, not to the level area.
+    """
+    def __init__(self, bucket_size=64):
+        """
+        Constructor.
+        :param bucket_size: a size of a square bucket
+        """
+        self.bucket_size = bucket_size  # a size of a square bucket
+        self.buckets = {}               # (bucket length index, bucket width index) -> list of placed containers
+        self.rectangles_nr = 0          # number of indexed rectangles
+
+    def __str__(self):
+        """
+        Create a string from the index. Used when call print(index).
+        :return: A string describing the index.
+        """
+        return f"RectangleIndex ({self.rectangles_nr} rectangles in {len(self.buckets)} buckets)"
+
+    def _get_buckets(self, length1, width1, length2, width2):
+        """
+        Private method.
+        Get keys of buckets overlapped by a given rectangle.
+        :param length1: the lower corner in the length axis
+        :param width1: the lower corner in the width axis
+        :param length2: the upper corner in the length axis (exclusive)
+        :param width2: the upper corner in the width axis (exclusive)
+        :return: a generator of keys of buckets
+        """
+        for bl in range(length1 // self.bucket_size, (length2 - 1) // self.bucket_size + 1):
+            for bw in range(width1 // self.bucket_size, (width2 - 1) // self.bucket_size + 1):
+                yield bl, bw
+
+    def add(self, placed_container):
+        """
+        Add a placed container to the index.
+        :param placed_container: a placed container
+        :return:
+        """
+        for key in self._get_buckets(placed_container.corner1.length, placed_container.corner1.width,
+                                     placed_container.corner2.length, placed_container.corner2.width):
+            self.buckets.setdefault(key, []).append(placed_container)
+        self.rectangles_nr += 1
+
+    def remove(self, placed_container):
+        """
+        Remove a placed container from the index.
+        :param placed_container: a placed container
+        :return:
+        """
+        for key in self._get_buckets(placed_container.corner1.length, placed_container.corner1.width,
+                                     placed_container.corner2.length, placed_container.corner2.width):
+            bucket = self.buckets[key]
+            bucket.remove(placed_container)
+            if len(bucket) == 0:
+                del self.buckets[key]
+        self.rectangles_nr -= 1
+
+    def query(self, length1, width1, length2, width2):
+        """
+        Get placed containers which overlap a given rectangle.
+        :param length1: the lower corner in the length axis
+        :param width1: the lower corner in the width axis
+        :param length2: the upper corner in the length axis (exclusive)
+        :param width2: the upper corner in the width axis (exclusive)
+        :return: a list of placed containers
+        """
+        result = {}
+        for key in self._get_buckets(length1, width1, length2, width2):
+            for x in self.buckets.get(key, ()):
+                if x.corner1.length < length2 and length1 < x.corner2.length and \
+                        x.corner1.width < width2 and width1 < x.corner2.width:
+                    result[id(x)] = x
+        return list(result.values())
+
+    def get_overlap_area(self, length1, width1, length2, width2):
+        """
+        Get an area of a given rectangle covered by indexed rectangles.
+        :param length1: the lower corner in the length axis
+        :param width1: the lower corner in the width axis
+        :param length2: the upper corner in the length axis (exclusive)
+        :param width2: the upper corner in the width axis (exclusive)
+        :return: a covered area
+        """
+        return sum((min(length2, x.corner2.length) - max(length1, x.corner1.length)) *
+                   (min(width2, x.corner2.width) - max(width1, x.corner1.width))
+                   for x in self.query(length1, width1, length2, width2))
+
+
+class SparseShipment(Shipment):
+    """
+    Class used for managing a single shipment of a very large ship.
+    Levels are stored as spatial indexes of rectangles (RectangleIndex) instead of dense maps, so memory is
+    proportional to the number of containers. The API is the same as of Shipment.
+    """
+    BUCKET_SIZE = 64                # a size of a bucket of spatial indexes
+    IF_EXHAUSTIVE = False           # (bool) if find_position() checks all positions of a level
+
+    def _materialize_level(self, height_level):
+        """
+        Private method.
+        Get an index of a level, creating it if the level is empty.
+        :param height_level: a height level
+        :return: an index of the level
+        """
+        if self.level_maps[height_level] is None:
+            self.level_maps[height_level] = RectangleIndex(bucket_size=self.BUCKET_SIZE)
+        return self.level_maps[height_level]
+
+    def _release_level(self, height_level):
+        """
+        Private method.
+        Mark a level as empty.
+        :param height_level: a height level
+        :return:
+        """
+        self.level_maps[height_level] = None
+
+    def share(self):
+        """
+        Levels are indexes, not maps, so they are not moved to shared memory.
+        :return: None
+        """
+        return None
+
+    def get_level_map(self, height_level):
+        """
+        Get a dense map of occupancy of a given level (rasterized from the index; costly for large ships).
+        :param height_level: a height level
+        :return: a new map of occupancy (length, width)
+        """
+        level_map = np.zeros(shape=(self.ship.length, self.ship.width), dtype=np.int8)
+        for placed_container in self.placed_containers_levels[height_level]:
+            Shipment._add_to_map(placed_container, level_map)
+        return level_map
+
+    @staticmethod
+    def _add_to_map(placed_container, the_map):
+        """
+        Private method.
+        Add a given container to an index of its level.
+        :param placed_container: a placed container to add
+        :param the_map: an index of a level
+        :return:
+        """
+        the_map.add(placed_container)
+
+    @staticmethod
+    def _remove_from_map(placed_container, the_map):
+        """
+        Private method.
+        Remove a given container from an index of its level.
+        :param placed_container: a placed container to remove
+        :param the_map: an index of a level
+        :return:
+        """
+        the_map.remove(placed_container)
+
+    def _check_if_unoccupied(self, placed_container, checked_map=None):
+        """
+        Private method.
+        Check if a space, a given container wants to take, is unoccupied.
+        :param placed_container: a placed container (a candidate to add to the shipment)
+        :param checked_map: (optional) a dense occupancy map used for checking
+        :return: True if if a space, a given container wants to take, is unoccupied, else False
+        """
+        if checked_map is not None:
+            return super()._check_if_unoccupied(placed_container, checked_map)
+        index = self.level_maps[placed_container.corner1.height_level]
+        return index is None or len(index.query(placed_container.corner1.length, placed_container.corner1.width,
+                                                placed_container.corner2.length, placed_container.corner2.width)) == 0
+
+    def _check_if_stable(self, placed_container, checked_map=None):
+        """
+        Private method.
+        Check if a given container would be stable.
+        :param placed_container: a placed container (a candidate to add to the shipment)
+        :param checked_map: (optional) a dense occupancy map used for checking
+        :return: True if a given container would be stable, else False
+        """
+        if checked_map is not None or placed_container.corner1.height_level == 0:
+            return super()._check_if_stable(placed_container, checked_map)
+        index = self.level_maps[placed_container.corner1.height_level - 1]
+        if index is None:
+            return False
+        area_below = index.get_overlap_area(placed_container.corner1.length, placed_container.corner1.width,
+                                            placed_container.corner2.length, placed_container.corner2.width)
+        return area_below >= (placed_container.container.length * placed_container.container.width) / 2
+
+    def get_free_runs(self, height_level):
+        """
+        Get upper bounds of the longest runs of free cells at a given height level (the ship dimensions;
+        exact runs would need a dense map).
+        :param height_level: a height level
+        :return: a tuple (the ship length, the ship width)
+        """
+        return self.ship.length, self.ship.width
+
+    def get_free_positions(self, container, height_level):
+        """
+        Get all corner positions at a given height level at which a given container can be added.
+        Levels are rasterized, so it is costly for large ships; find_position() should be preferred.
+        :param container: a container
+        :param height_level: a height level
+        :return: a 2D boolean array; an element [l, w] is True if the corner (l, w) is correct (may be empty)
+        """
+        if not 0 <= height_level < self.levels_nr or not self.can_possibly_fit(container, height_level) or \
+                height_level > 0 and self.level_maps[height_level - 1] is None:
+            return np.zeros(shape=(0, 0), dtype=bool)
+        positions = self._get_window_sums(self.get_level_map(height_level), container.length, container.width) == 0
+        if height_level > 0:
+            area_below = self._get_window_sums(self.get_level_map(height_level - 1),
+                                               container.length, container.width)
+            positions &= area_below >= (container.length * container.width) / 2
+        return positions
+
+    def check_and_add_many(self, containers, corners):
+        """
+        Check if all given containers can be added at given positions and if so, add them.
+        All containers are added or none of them. Dense batch maps would be too big, so containers are checked
+        one by one (from the lowest level) in a transaction, which is rolled back on the first failure.
+        :param containers: a list of containers
+        :param corners: an array-like (containers number, 3) of corner positions (length, width, height level)
+        :return: True if successfully added, else False
+        """
+        corners = np.asarray(corners, dtype=np.int64).reshape(-1, 3)
+        if len(corners) != len(containers):
+            return False
+        self.begin()
+        for i in np.argsort(corners[:, 2], kind="stable"):
+            if not self.check_and_add(PlacedContainer(containers[i], corner1=CornerPosition(
+                    length=int(corners[i, 0]), width=int(corners[i, 1]), height_level=int(corners[i, 2])))):
+                self.rollback()
+                return False
+        self.commit()
+        return True
+
+    def check_and_join(self, shipment):
+        """
+        Check if all containers from the given shipment can be added to this shipment and if so, add it
+        (see Shipment.check_and_join). Levels are indexes, so shifted containers are checked and added
+        by check_and_add_many().
+        :param shipment: a joined shipment
+        :return: True if successfully added, else False
+        """
+        used_levels_nr = self.get_used_levels_nr()
+        if self.ship != shipment.ship or used_levels_nr + shipment.get_used_levels_nr() > self.levels_nr:
+            return False
+        placed_containers = [x for level in shipment.placed_containers_levels for x in level]
+        return self.check_and_add_many([x.container for x in placed_containers],
+                                       [(x.corner1.length, x.corner1.width, x.corner1.height_level + used_levels_nr)
+                                        for x in placed_containers])
+
+    def find_position(self, container, first_height_level=0):
+        """
+        Find a corner position among candidate corners (see Shipment.find_candidate_position), because scanning
+        all cells of a very large ship is too slow.
+        :param container: a container
+        :param first_height_level: the lowest height level which is searched
+        :return: a corner position or None
+        """
+        return self.find_candidate_position(container, first_height_level)
+
+
 class ShipmentsManager:
     """
     Class used for storing and managing shipments.
@@ -416,6 +1442,49 @@ class ShipmentsManager:
         """
         return sum([sh.get_empty_volume(only_used_levels) for sh in self.shipments])
 
+    def release(self, keep=()):
+        """
+        Release occupancy maps of all shipments (see Shipment.release()), e.g. when a solution is discarded.
+        :param keep: shipments which are still used and must not be released
+        :return:
+        """
+        for sh in self.shipments:
+            if all(sh is not x for x in keep):
+                sh.release()
+
+    def get_cost(self):
+        """
+        Get a cost of the shipments used for comparing solutions. Lower is better.
+        :return: a tuple (number of shipments, summary empty volume in used height levels)
+        """
+        return len(self.shipments), self.get_summary_empty_volume(only_used_levels=True)
+
+    def rebind(self, ships, containers, previous_shipment=None):
+        """
+        Replace copies of ships, containers and a previous shipment (e.g. created by sending the shipments manager
+        to another process) with the original objects, so they can be compared by identity.
+        :param ships: a list of original ships
+        :param containers: a list of original containers
+        :param previous_shipment: an original previous shipment or None
+        :return:
+        """
+        ships_by_id = {s.sid: s for s in ships}
+        containers_by_id = {c.cid: c for c in containers}
+        previous_cids = None
+        if previous_shipment is not None:
+            previous_cids = [c.cid for c in previous_shipment.get_all_containers()]
+        for i, sh in enumerate(self.shipments):
+            if previous_cids is not None and sh.ship.sid == previous_shipment.ship.sid and \
+                    [c.cid for c in sh.get_all_containers()] == previous_cids:
+                self.shipments[i] = previous_shipment
+                continue
+            sh.ship = ships_by_id.get(sh.ship.sid, sh.ship)
+            for level in sh.placed_containers_levels:
+                for placed_container in level:
+                    placed_container.container = containers_by_id.get(placed_container.container.cid,
+                                                                      placed_container.container)
+            sh.all_containers = [containers_by_id.get(c.cid, c) for c in sh.all_containers]
+
     def get_containers(self, skip_first_shipment=False, skip_last_shipment=False):
         """
         Get a list of containers in all shipments.
@@ -476,7 +1545,7 @@ class ShipmentsManager:
         :return: True if successfully added, else False
         """
         if_can = False
-        if type(shipment) is Shipment:
+        if isinstance(shipment, Shipment):
             if_can = self._check_shipment_timestamps(shipment) and self._check_redundancy(shipment)
         if if_can:
             self.shipments.append(shipment)
@@ -530,6 +1599,177 @@ def test1():
     print(sh.get_timestamps_set())
 
 
+def test3():
+    sh = Shipment(Ship(sid=1, length=5, width=5, height=20, timestamp=39), containers_height=10)
+    pc1 = PlacedContainer(container=Container(cid=1, length=2, width=2, height=10, timestamp=39),
+                          corner1=CornerPosition(height_level=0, length=0, width=0))
+    pc2 = PlacedContainer(container=Container(cid=2, length=2, width=2, height=10, timestamp=39),
+                          corner1=CornerPosition(height_level=1, length=0, width=0))
+    pc3 = PlacedContainer(container=Container(cid=3, length=1, width=1, height=10, timestamp=39),
+                          corner1=CornerPosition(height_level=0, length=3, width=3))
+    sh.check_and_add(pc1)
+    sh.begin()
+    sh.check_and_add(pc2)
+    occupancy_map = sh.occupancy_map
+    sh.begin()
+    sh.remove_recursively(pc1)
+    sh.check_and_add(pc3)
+    print(sh)
+    assert sh.get_all_containers() == [pc3.container]
+    sh.rollback()
+    print(sh)
+    assert sh.get_all_containers() == [pc1.container, pc2.container]
+    assert np.array_equal(sh.occupancy_map, occupancy_map) and sh.get_support_area(pc2) == 4
+    sh.commit()
+    sh.begin()
+    sh.remove_recursively(pc1)
+    sh.rollback()
+    print(sh)
+    assert sh.get_all_containers() == [pc1.container, pc2.container] and len(sh.journals) == 0
+    assert np.array_equal(sh.occupancy_map, occupancy_map)
+    assert not sh.rollback() and not sh.commit()
+
+
+def test4():
+    sh = Shipment.create(Ship(sid=1, length=5000, width=5000, height=20, timestamp=39), containers_height=10)
+    for cid in range(1, 6):
+        container = Container(cid=cid, length=300, width=200, height=10, timestamp=39)
+        sh.check_and_add(PlacedContainer(container=container, corner1=sh.find_position(container)))
+    print(type(sh).__name__)
+    print(sh.to_string(get_map=True))
+
+
+def test5():
+    sh = Shipment(Ship(sid=1, length=5, width=5, height=20, timestamp=39), containers_height=10)
+    sh.check_and_add(PlacedContainer(container=Container(cid=1, length=2, width=2, height=10, timestamp=39),
+                                     corner1=CornerPosition(height_level=0, length=0, width=0)))
+    sh.share()
+    copy = pickle.loads(pickle.dumps(sh))
+    assert not copy.shared_map.if_owner and copy.shared_map.memory.name == sh.shared_map.memory.name
+    # copy on write
+    copy.check_and_add(PlacedContainer(container=Container(cid=2, length=1, width=1, height=10, timestamp=39),
+                                       corner1=CornerPosition(height_level=0, length=3, width=3)))
+    assert copy.shared_map is None and np.sum(copy.level_maps[0]) == 5 and np.sum(sh.level_maps[0]) == 4
+    # releasing a copy does not clear the map of the owner
+    pickle.loads(pickle.dumps(sh)).release()
+    assert np.sum(sh.level_maps[0]) == 4
+    sh.unshare()
+    assert sh.shared_map is None and np.sum(sh.level_maps[0]) == 4
+
+
+def test6():
+    sh = Shipment(Ship(sid=1, length=5, width=5, height=40, timestamp=39), containers_height=10)
+    assert sh.get_materialized_levels_nr() == 0
+    # maps of levels are allocated only when containers are added to them
+    pc1 = PlacedContainer(container=Container(cid=1, length=2, width=2, height=10, timestamp=39),
+                          corner1=CornerPosition(height_level=0, length=0, width=0))
+    assert sh.check_and_add(pc1) and sh.get_materialized_levels_nr() == 1
+    assert not sh.check_and_add(PlacedContainer(container=Container(cid=2, length=2, width=2, height=10, timestamp=39),
+                                                corner1=CornerPosition(height_level=2, length=0, width=0)))
+    assert sh.find_position(Container(cid=3, length=5, width=5, height=10, timestamp=39)) is None
+    assert np.sum(sh.occupancy_map) == 4 and sh.get_materialized_levels_nr() == 1
+    pc4 = PlacedContainer(container=Container(cid=4, length=2, width=2, height=10, timestamp=39),
+                          corner1=CornerPosition(height_level=1, length=0, width=0))
+    assert sh.check_and_add(pc4) and sh.get_materialized_levels_nr() == 2
+    # maps of emptied levels are returned to the buffer pool
+    sh.remove_recursively(pc1)
+    assert sh.get_materialized_levels_nr() == 0 and sh.level_maps == [None] * 4
+
+
+def test7():
+    sh = Shipment(Ship(sid=1, length=4, width=4, height=30, timestamp=39), containers_height=10)
+    placed_containers = []
+    for cid, length, width, l, w, height_level in ((1, 2, 4, 0, 0, 0), (2, 2, 4, 2, 0, 0), (3, 4, 2, 0, 0, 1),
+                                                   (4, 2, 2, 0, 0, 2)):
+        placed_containers.append(PlacedContainer(container=Container(cid=cid, length=length, width=width, height=10,
+                                                                     timestamp=39),
+                                                 corner1=CornerPosition(height_level=height_level, length=l, width=w)))
+        assert sh.check_and_add(placed_containers[-1])
+    pc1, pc2, pc3, pc4 = placed_containers
+    assert sh.supported_by[pc3] == {pc1: 4, pc2: 4} and sh.supporting[pc3] == {pc4: 4}
+    # half of the footprint is still supported
+    assert sh.check_and_remove(pc1)
+    assert sh.supported_by[pc3] == {pc2: 4} and sh.get_support_area(pc3) == 4
+    assert not sh.check_and_remove(pc2)
+    sh.remove_recursively(pc2)
+    assert sh.get_all_containers() == [] and sh.supported_by == {} and sh.supporting == {}
+
+
+def test8():
+    rng = np.random.default_rng(0)
+    sh = Shipment(Ship(sid=1, length=6, width=5, height=30, timestamp=39), containers_height=10)
+    for cid in range(1, 30):
+        container = Container(cid=cid, length=int(rng.integers(1, 5)), width=int(rng.integers(1, 5)), height=10,
+                              timestamp=39)
+        # the cheap conditions never reject a level with a correct position
+        for height_level in range(sh.levels_nr):
+            assert sh.can_possibly_fit(container, height_level) or \
+                   not np.any(sh.get_free_positions(container, height_level))
+        corner = sh.find_position(container)
+        if corner is not None:
+            sh.check_and_add(PlacedContainer(container=container, corner1=corner))
+    assert sh.free_area == [30 - sum(x.container.length * x.container.width for x in level)
+                            for level in sh.placed_containers_levels]
+    assert not sh.can_possibly_fit(Container(cid=30, length=7, width=1, height=10, timestamp=39), 0)
+
+
+def test9():
+    pool = OccupancyBufferPool(max_buffers_per_shape=1)
+    ship = Ship(sid=1, length=5, width=5, height=20, timestamp=39)
+    sh1 = Shipment(ship, containers_height=10)
+    sh1.buffer_pool = pool
+    for height_level in range(2):
+        sh1.check_and_add(PlacedContainer(container=Container(cid=height_level + 1, length=3, width=3, height=10,
+                                                              timestamp=39),
+                                          corner1=CornerPosition(height_level=height_level, length=0, width=0)))
+    level_map = sh1.level_maps[0]
+    assert pool.allocated_nr == 2 and pool.reused_nr == 0
+    # only one map of the shape is kept
+    sh1.release()
+    assert len(pool.buffers[(5, 5)]) == 1
+    sh2 = Shipment(ship, containers_height=10)
+    sh2.buffer_pool = pool
+    sh2.check_and_add(PlacedContainer(container=Container(cid=3, length=1, width=1, height=10, timestamp=39),
+                                      corner1=CornerPosition(height_level=0, length=4, width=4)))
+    assert pool.reused_nr == 1 and sh2.level_maps[0] is level_map and np.sum(level_map) == 1
+    sh3 = Shipment(Ship(sid=2, length=4, width=5, height=20, timestamp=39), containers_height=10)
+    sh3.buffer_pool = pool
+    sh3.check_and_add(PlacedContainer(container=Container(cid=4, length=1, width=1, height=10, timestamp=39),
+                                      corner1=CornerPosition(height_level=0, length=0, width=0)))
+    assert pool.allocated_nr == 3 and pool.reused_nr == 1
+
+
+def test10():
+    ship = Ship(sid=1, length=4, width=4, height=40, timestamp=39)
+
+    def create(placements, cid=1):
+        shipment = Shipment(ship, containers_height=10)
+        for length, width, l, w, height_level in placements:
+            assert shipment.check_and_add(PlacedContainer(
+                container=Container(cid=cid, length=length, width=width, height=10, timestamp=39),
+                corner1=CornerPosition(height_level=height_level, length=l, width=w)))
+            cid += 1
+        return shipment
+
+    sh1 = create([(4, 2, 0, 0, 0), (4, 2, 0, 2, 0), (4, 2, 0, 0, 1)])
+    sh2 = create([(2, 2, 0, 0, 0), (2, 2, 2, 0, 0), (2, 2, 1, 0, 1)], cid=4)
+    # the same as adding containers of the joined shipment one by one above the used levels
+    expected = create([(4, 2, 0, 0, 0), (4, 2, 0, 2, 0), (4, 2, 0, 0, 1)])
+    for x in sh2.placed_containers_levels[0] + sh2.placed_containers_levels[1]:
+        assert expected.check_and_add(x.get_shifted_copy(diff_height_level=2))
+    assert sh1.check_and_join(sh2)
+    assert np.array_equal(sh1.occupancy_map, expected.occupancy_map) and sh1.free_area == expected.free_area
+    assert [sh1.get_free_runs(h) for h in range(4)] == [expected.get_free_runs(h) for h in range(4)]
+    assert sh1.occupied_area == expected.occupied_area and \
+           [c.cid for c in sh1.get_all_containers()] == [c.cid for c in expected.get_all_containers()]
+    assert [sh1.get_support_area(x) for x in sh1.placed_containers_levels[3]] == [4]
+    # unstable containers of the lowest level of a joined shipment
+    sh3 = create([(4, 2, 0, 0, 0), (4, 2, 0, 0, 1)])
+    sh4 = create([(2, 2, 0, 2, 0)], cid=10)
+    occupancy_map = sh3.occupancy_map
+    assert not sh3.check_and_join(sh4) and np.array_equal(sh3.occupancy_map, occupancy_map)
+
+
 def test2():
     sh1 = Shipment(Ship(sid=1, length=5, width=5, height=20, timestamp=39), containers_height=10)
     sh2 = Shipment(Ship(sid=1, length=5, width=5, height=20, timestamp=39), containers_height=10)
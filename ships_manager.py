@@ -121,18 +121,27 @@ class ShipsManager:
                 ship = None
         return ship
 
-    def get_available(self, max_timestamp):
+    def find_available(self, max_timestamp):
         """
-        Save and get list of available ships.
+        Get list of ships which are available at a given timestamp (the latest added ones), without saving it.
         :param max_timestamp: maximum timestamp a ship must have
         :return: a list of available ships
         """
-        self.available = []
+        available = []
         for ship in reversed(self.ships):
             if ship.timestamp <= max_timestamp:
-                self.available.append(ship)
-                if len(self.available) >= self.max_available:
+                available.append(ship)
+                if len(available) >= self.max_available:
                     break
+        return available
+
+    def get_available(self, max_timestamp):
+        """
+        Save and get list of available ships.
+        :param max_timestamp: maximum timestamp a ship must have
+        :return: a list of available ships
+        """
+        self.available = self.find_available(max_timestamp)
         return self.available
 
 
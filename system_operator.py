@@ -1,26 +1,88 @@
-from containers_manager import ContainersManager
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from containers_manager import ContainersManager, Container
 from optimizer import OptimizerSelector
-from ships_manager import ShipsManager
+from ships_manager import ShipsManager, Ship
+from shipments_manager import Shipment, SparseShipment, prepare_shared_memory
 from report_generator import ReportGenerator
 from timestamps_manager import TimestampsManager
 
 
+def _optimize_height_class(args):
+    """
+    Optimize containers of a single height class. Used by Operator (also in worker processes).
+    :param args: a tuple (optimizer algorithm number, optimizer workers number, ships, containers, timestamp,
+                 container height, previous shipment, deadline, if incremental)
+    :return: a tuple (shipments manager, optimizer statistics, time spent in seconds)
+    """
+    algorithm, optimizer_workers, ships, containers, timestamp, container_height, previous_shipment, deadline, \
+        incremental = args
+    optimizer = OptimizerSelector.select(algorithm, workers=optimizer_workers)
+    start_time = time.monotonic()
+    optimize = optimizer.extend if incremental else optimizer.optimize
+    shipments_manager = optimize(ships, containers, timestamp=timestamp, container_height=container_height,
+                                 previous_shipment=previous_shipment, deadline=deadline)
+    optimizer.close()
+    return shipments_manager, optimizer.get_statistics(), time.monotonic() - start_time
+
+
 class Operator:
     """
     Class used for managing the whole system.
     """
-    def __init__(self, optimizer_algorithm_file="optimizer_algorithm.txt"):
+    CHECKPOINT_FILE = "checkpoint.json"     # a basename of a checkpoint file in a checkpoint directory
+    CHECKPOINT_SENT_FILE = "checkpoint.json.sent"   # a basename of a file to which sent shipments are appended
+
+    def __init__(self, optimizer_algorithm_file="optimizer_algorithm.txt", time_budget=None, lookahead=None,
+                 dwell_weight=0.0, dwell_sla=None, incremental=False, workers=None, optimizer_workers=None,
+                 checkpoint_dir=None, checkpoint_every=1):
         """
         Constructor.
         :param optimizer_algorithm_file: a path to file with optimizer algorithm number
+        :param time_budget: (optional) optimization time budget per timestamp in seconds
+        :param lookahead: (optional) number of next timestamps used for deciding if an uncompleted shipment
+                          should be held or dispatched; None means always hold
+        :param dwell_weight: a cost of a single container waiting for one timestamp unit, in ships
+        :param dwell_sla: (optional) maximum dwell time of a container; an uncompleted shipment is dispatched
+                          if any of its containers would exceed it at the next timestamp
+        :param incremental: (bool) if the uncompleted shipment is extended by new containers only
+                            (see IOptimizer.extend) instead of optimizing all waiting containers again
+        :param workers: number of worker processes optimizing height classes of containers in parallel
+                        (None means the number of CPUs, 1 means no process pool)
+        :param optimizer_workers: number of worker processes of an optimizer running restarts in parallel
+                                  (see MultiStartOptimizer; None means the number of CPUs, 1 means no process pool)
+        :param checkpoint_dir: (optional) a directory in which a checkpoint of the state is saved during optimization
+                               (see save_checkpoint()); None means no checkpoints
+        :param checkpoint_every: number of completed timestamps between checkpoints
         """
         self.optimizer_algorithm_file = optimizer_algorithm_file    # a path to file with optimizer algorithm number
+        self.time_budget = time_budget                              # optimization time budget per timestamp [s]
+        self.lookahead = lookahead                                  # number of next timestamps for planning
+        self.dwell_weight = dwell_weight                            # a cost of waiting of a container [ships]
+        self.dwell_sla = dwell_sla                                  # maximum dwell time of a container
+        self.incremental = incremental                              # (bool) if optimize incrementally
+        self.workers = workers                                      # number of worker processes
+        self.optimizer_workers = optimizer_workers                  # number of worker processes of an optimizer
+        self.checkpoint_dir = checkpoint_dir                        # a directory for checkpoints or None
+        self.checkpoint_every = checkpoint_every                    # number of timestamps between checkpoints
 
         self.report_generator = None        # a report generator
         self.timestamps_manager = None      # a timestamps manager
         self.ships_manager = None           # a ships manager
         self.containers_manager = None      # a containers manager
         self.optimizer = None               # an optimizer
+        self.optimizer_algorithm = None     # an optimizer algorithm number
+        self.input_file = None              # a file (name) with input data
+        self.uncompleted_shipments = {}     # height of containers -> an uncompleted shipment
+        self.checkpoint_sent = (0, 0, 0)    # (size of the file of sent shipments, number of sent shipments,
+                                            #  number of sent containers) saved by the last checkpoint
 
     def select_optimizer_algorithm(self, optimizer_algorithm=0):
         """
@@ -62,77 +124,484 @@ class Operator:
         self.report_generator.decrease_indent()
         self.report_generator.log(f"Finished entering data.")
 
-    def optimize(self):
+    def should_dispatch(self, uncompleted_shipment, timestamp):
+        """
+        Decide (using a rolling horizon of the next lookahead timestamps) if an uncompleted shipment should be
+        dispatched now instead of being held and filled with containers from the next timestamps.
+        Both choices are simulated timestamp by timestamp over the horizon: at every timestamp the arriving
+        containers join the held area, full ships leave and the rest waits for the next timestamp; the area left
+        at the end of the horizon needs ships of its own. The cost of a choice is the number of ships plus waiting
+        of the held containers (see estimate_horizon_cost()); dispatching costs one more ship for the shipment itself.
+        The shipment is held on ties, so with dwell_weight = 0 it is dispatched only if the ships available
+        in the horizon are too small to take the held containers together with the arriving ones.
+        :param uncompleted_shipment: an uncompleted shipment
+        :param timestamp: a current timestamp
+        :return: True if the shipment should be dispatched, else False
+        """
+        next_timestamps = self.timestamps_manager.get_next(timestamp, self.lookahead)
+        if len(next_timestamps) == 0:
+            return True
+        containers_height = uncompleted_shipment.containers_height
+        arriving = {t: [0, 0] for t in next_timestamps}     # timestamp -> [area, number] of arriving containers
+        for c in self.containers_manager.waiting_containers:
+            if c.timestamp in arriving and c.height == containers_height:
+                arriving[c.timestamp][0] += c.length * c.width
+                arriving[c.timestamp][1] += 1
+        held_nr = len(uncompleted_shipment.get_all_containers())
+        hold_cost = self.estimate_horizon_cost(timestamp, arriving, containers_height,
+                                               uncompleted_shipment.occupied_area, held_nr)
+        dispatch_cost = 1 + self.estimate_horizon_cost(timestamp, arriving, containers_height, 0, 0)
+        return dispatch_cost < hold_cost
+
+    def estimate_horizon_cost(self, timestamp, arriving, containers_height, held_area, held_nr):
+        """
+        Estimate the cost of shipping held and arriving containers of one height over a horizon of timestamps.
+        Ships are estimated by an area lower bound using the biggest ship available at every timestamp
+        (see ShipsManager.find_available()); a container held for one timestamp unit costs dwell_weight.
+        :param timestamp: a current timestamp
+        :param arriving: a dictionary {next timestamp: [area, number] of arriving containers}
+        :param containers_height: constant height of containers
+        :param held_area: an area of containers held at the current timestamp
+        :param held_nr: number of containers held at the current timestamp
+        :return: the estimated cost in ships (infinity if no available ship can take the containers)
+        """
+        cost = 0
+        previous_timestamp = timestamp
+        for t, (area, nr) in sorted(arriving.items()):
+            cost += self.dwell_weight * held_nr * (t - previous_timestamp)
+            capacity = max([(s.height // containers_height) * s.length * s.width
+                            for s in self.ships_manager.find_available(max_timestamp=t)], default=0)
+            if capacity == 0:
+                return math.inf
+            total_area, total_nr = held_area + area, held_nr + nr
+            full_ships = total_area // capacity
+            cost += full_ships
+            held_area = total_area - full_ships * capacity
+            held_nr = round(total_nr * held_area / total_area) if total_area > 0 else 0
+            previous_timestamp = t
+        return cost + math.ceil(held_area / capacity)
+
+    def violates_sla(self, uncompleted_shipment, timestamp):
+        """
+        Check if holding an uncompleted shipment until the next timestamp would make dwell time of any of its
+        containers exceed the SLA.
+        :param uncompleted_shipment: an uncompleted shipment
+        :param timestamp: a current timestamp
+        :return: True if the SLA would be exceeded, else False
+        """
+        next_timestamps = self.timestamps_manager.get_next(timestamp, 1)
+        if len(next_timestamps) == 0:
+            return False
+        return any(next_timestamps[0] - c.timestamp > self.dwell_sla
+                   for c in uncompleted_shipment.get_all_containers())
+
+    def optimize_height_classes(self, ships, containers_by_height, timestamp, uncompleted_shipments, executor):
+        """
+        Optimize containers of every height class separately: in worker processes if an executor is given and there
+        are many classes, else one by one with the time budget divided between classes.
+        :param ships: a list of available ships
+        :param containers_by_height: a dictionary {height: list of containers}
+        :param timestamp: a main timestamp
+        :param uncompleted_shipments: a dictionary {height: an uncompleted shipment}
+        :param executor: a process pool executor or None
+        :return: a dictionary {height: (shipments manager, optimizer statistics, time spent in seconds)}
+        """
+        heights = sorted(containers_by_height)
+        start_time = time.monotonic()
+        results = {}
+        if executor is None or len(heights) == 1:
+            optimize = self.optimizer.extend if self.incremental else self.optimizer.optimize
+            for i, height in enumerate(heights):
+                class_start_time = time.monotonic()
+                deadline = None if self.time_budget is None else \
+                    start_time + self.time_budget * (i + 1) / len(heights)
+                shipments_manager = optimize(ships, containers_by_height[height],
+                                             timestamp=timestamp,
+                                             container_height=height,
+                                             previous_shipment=uncompleted_shipments.get(height),
+                                             deadline=deadline)
+                results[height] = (shipments_manager, self.optimizer.get_statistics(),
+                                   time.monotonic() - class_start_time)
+        else:
+            deadline = None if self.time_budget is None else start_time + self.time_budget
+            # workers read maps of uncompleted shipments from shared memory instead of copies
+            shared_shipments = [sh for height, sh in uncompleted_shipments.items() if height in containers_by_height
+                                and sh.shared_map is None and sh.share() is not None]
+            try:
+                args = [(self.optimizer_algorithm, self.optimizer_workers, ships, containers_by_height[height],
+                         timestamp, height, uncompleted_shipments.get(height), deadline, self.incremental)
+                        for height in heights]
+                for height, result in zip(heights, executor.map(_optimize_height_class, args)):
+                    result[0].rebind(ships, containers_by_height[height], uncompleted_shipments.get(height))
+                    results[height] = result
+            finally:
+                for shipment in shared_shipments:
+                    shipment.unshare()
+        return results
+
+    def save_checkpoint(self, max_timestamp):
+        """
+        Save the state of the system after completed timestamps, so a long run can be resumed (see load_checkpoint()):
+        timestamps, ships and containers managers, progress of the report and uncompleted shipments.
+        Maps of occupancy of uncompleted shipments are saved as .npy files. Shipments and containers sent since
+        the previous checkpoint are appended as a single line to the file of sent shipments, which the checkpoint file
+        refers to by its size, so the cost of a checkpoint does not grow with the number of sent shipments.
+        The checkpoint file is replaced atomically, so a crash during saving leaves the previous checkpoint.
+        :param max_timestamp: the next timestamp to optimize
+        :return:
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        uncompleted_shipments = []
+        for height, shipment in sorted(self.uncompleted_shipments.items()):
+            map_file = None
+            if not isinstance(shipment, SparseShipment):
+                map_file = f"uncompleted_{height}_{max_timestamp}.npy"
+                np.save(os.path.join(self.checkpoint_dir, map_file), shipment.occupancy_map)
+            uncompleted_shipments.append({"height": height, "shipment": shipment.describe(), "map": map_file})
+
+        ships_manager, containers_manager = self.ships_manager, self.containers_manager
+        size, shipments_nr, sent_containers_nr = self.checkpoint_sent
+        shipments_list, sent_containers = self.report_generator.shipments_list, containers_manager.sent_containers
+        sent = {
+            "shipments": [{"height": sh.containers_height, "shipment": sh.describe()}
+                          for sh in shipments_list[shipments_nr:]],
+            "sent_containers": [(c.cid, c.length, c.width, c.height, c.timestamp)
+                                for c in sent_containers[sent_containers_nr:]],
+        }
+        with open(os.path.join(self.checkpoint_dir, self.CHECKPOINT_SENT_FILE), "ab") as f:
+            # a line appended after the previous checkpoint by an interrupted saving is overwritten
+            f.truncate(size)
+            f.write(json.dumps(sent).encode() + b"\n")
+            size = f.tell()
+
+        state = {
+            "input_file": self.input_file,
+            "optimizer_algorithm": self.optimizer_algorithm,
+            "max_timestamp": max_timestamp,
+            "timestamps": {"min": self.timestamps_manager.min, "max": self.timestamps_manager.max,
+                           "timestamps": list(self.timestamps_manager.timestamps)},
+            "ships": [(s.sid, s.length, s.width, s.height, s.timestamp) for s in ships_manager.ships],
+            "available_ships": [s.sid for s in ships_manager.available],
+            "waiting_containers": [(c.cid, c.length, c.width, c.height, c.timestamp)
+                                   for c in containers_manager.waiting_containers],
+            "sent": {"size": size, "shipments_nr": len(shipments_list), "sent_containers_nr": len(sent_containers)},
+            "const_h": containers_manager.const_h,
+            "dwell_times": list(containers_manager.dwell_times.items()),
+            "uncompleted_shipments": uncompleted_shipments,
+            "optimization_steps": self.report_generator.optimization_steps,
+        }
+        filename = os.path.join(self.checkpoint_dir, self.CHECKPOINT_FILE)
+        with open(filename + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(filename + ".tmp", filename)
+        self.checkpoint_sent = (size, len(shipments_list), len(sent_containers))
+
+        map_files = {x["map"] for x in uncompleted_shipments}
+        for name in os.listdir(self.checkpoint_dir):
+            if name.startswith("uncompleted_") and name.endswith(".npy") and name not in map_files:
+                os.remove(os.path.join(self.checkpoint_dir, name))
+
+    def read_checkpoint(self):
+        """
+        Read a checkpoint file from the checkpoint directory.
+        :return: a state (dictionary) saved by save_checkpoint() or None if there is no checkpoint
+        """
+        if self.checkpoint_dir is None:
+            return None
+        filename = os.path.join(self.checkpoint_dir, self.CHECKPOINT_FILE)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, "r") as f:
+            return json.load(f)
+
+    def load_checkpoint(self, state):
+        """
+        Restore the state of the system saved by save_checkpoint(). Uncompleted shipments are rebuilt from placements
+        of containers and compared with saved maps of occupancy (opened as memory-mapped files).
+        Managers and the report generator must be already created.
+        :param state: a state read by read_checkpoint()
+        :return:
+        """
+        self.timestamps_manager.timestamps.update(state["timestamps"]["timestamps"])
+        self.timestamps_manager.min = state["timestamps"]["min"]
+        self.timestamps_manager.max = state["timestamps"]["max"]
+
+        self.ships_manager.ships = [Ship(sid=sid, length=length, width=width, height=height, timestamp=timestamp)
+                                    for sid, length, width, height, timestamp in state["ships"]]
+        ships_by_id = {s.sid: s for s in self.ships_manager.ships}
+        self.ships_manager.available = [ships_by_id[sid] for sid in state["available_ships"]]
+
+        with open(os.path.join(self.checkpoint_dir, self.CHECKPOINT_SENT_FILE), "rb") as f:
+            sent = [json.loads(line) for line in f.read(state["sent"]["size"]).splitlines()]
+        self.checkpoint_sent = (state["sent"]["size"], state["sent"]["shipments_nr"],
+                                state["sent"]["sent_containers_nr"])
+
+        containers_manager = self.containers_manager
+        containers_manager.waiting_containers = [Container(cid=cid, length=length, width=width, height=height,
+                                                           timestamp=timestamp)
+                                                 for cid, length, width, height, timestamp
+                                                 in state["waiting_containers"]]
+        containers_manager.sent_containers = [Container(cid=cid, length=length, width=width, height=height,
+                                                        timestamp=timestamp)
+                                              for x in sent
+                                              for cid, length, width, height, timestamp in x["sent_containers"]]
+        containers_manager.const_h = state["const_h"]
+        containers_manager.dwell_times = {cid: dwell_time for cid, dwell_time in state["dwell_times"]}
+
+        waiting_by_id = {c.cid: c for c in containers_manager.waiting_containers}
+        sent_by_id = {c.cid: c for c in containers_manager.sent_containers}
+        self.uncompleted_shipments = {}
+        for x in state["uncompleted_shipments"]:
+            shipment = Shipment.from_description(x["shipment"], ships_by_id, waiting_by_id, x["height"])
+            if shipment is None:
+                raise ValueError(f"Incorrect uncompleted shipment in the checkpoint: {x['shipment']}")
+            if x["map"] is not None:
+                saved_map = np.load(os.path.join(self.checkpoint_dir, x["map"]), mmap_mode="r")
+                if not np.array_equal(saved_map, shipment.occupancy_map):
+                    raise ValueError(f"Map of occupancy of an uncompleted shipment does not match the checkpoint: "
+                                     f"{x['map']}")
+            self.uncompleted_shipments[x["height"]] = shipment
+
+        self.report_generator.shipments_list = []
+        for x in [y for z in sent for y in z["shipments"]]:
+            shipment = Shipment.from_description(x["shipment"], ships_by_id, sent_by_id, x["height"])
+            if shipment is None:
+                raise ValueError(f"Incorrect sent shipment in the checkpoint: {x['shipment']}")
+            self.report_generator.shipments_list.append(shipment)
+        self.report_generator.optimization_steps = [(timestamp, time_spent, time_budget, tuple(cost))
+                                                    for timestamp, time_spent, time_budget, cost
+                                                    in state["optimization_steps"]]
+
+        self.report_generator.new_section()
+        self.report_generator.log(f"Resumed from a checkpoint in {self.checkpoint_dir} "
+                                  f"(input = {state['input_file']}) at timestamp {state['max_timestamp']}: "
+                                  f"waiting containers = {len(containers_manager.waiting_containers)}, "
+                                  f"sent containers = {len(containers_manager.sent_containers)}, "
+                                  f"uncompleted shipments = {len(self.uncompleted_shipments)}")
+
+    def remove_checkpoint(self):
+        """
+        Remove a checkpoint (used after the whole optimization is finished).
+        :return:
+        """
+        if self.checkpoint_dir is None or not os.path.isdir(self.checkpoint_dir):
+            return
+        for name in os.listdir(self.checkpoint_dir):
+            if name.startswith(self.CHECKPOINT_FILE) or (name.startswith("uncompleted_") and name.endswith(".npy")):
+                os.remove(os.path.join(self.checkpoint_dir, name))
+
+    def optimize(self, if_resumed=False):
         """
         Optimize. See a sequence diagram.
+        Containers of different heights are optimized separately (see optimize_height_classes()), every height class
+        has its own uncompleted shipment.
+        :param if_resumed: (bool) if continue from a state restored from a checkpoint (see load_checkpoint())
         :return:
         """
-        self.timestamps_manager.set_max(self.timestamps_manager.get_min())
+        if not if_resumed:
+            self.timestamps_manager.set_max(self.timestamps_manager.get_min())
+            self.uncompleted_shipments = {}
         max_timestamp = self.timestamps_manager.get_max()
         self.report_generator.start_optimization()
 
-        uncompleted_shipment = None
-        while True:
-            containers = self.containers_manager.get_containers(max_timestamp=max_timestamp)
-            if len(containers) > 0:
-                self.timestamps_manager.set_min(min([c.timestamp for c in containers]))
-                ships = self.ships_manager.get_available(max_timestamp=self.timestamps_manager.get_min())
-                shipment_manager = self.optimizer.optimize(ships, containers,
-                                                           timestamp=max_timestamp,
-                                                           container_height=self.containers_manager.const_h,
-                                                           previous_shipment=uncompleted_shipment)
-
-                completed_shipments = shipment_manager.shipments[0:-1]
-                uncompleted_shipment = shipment_manager.shipments[-1]
-                containers_to_send = shipment_manager.get_containers(skip_last_shipment=True)
-                self.containers_manager.send(containers_to_send)
-                self.report_generator.send_containers(timestamp=max_timestamp,
-                                                      available_ships=ships,
-                                                      completed_shipments=completed_shipments,
-                                                      uncompleted_shipment=uncompleted_shipment)
-
-                next_timestamp = self.timestamps_manager.increase_max()
-                if next_timestamp > -1:
-                    max_timestamp = next_timestamp
+        uncompleted_shipments = self.uncompleted_shipments      # height of containers -> an uncompleted shipment
+        completed_timestamps_nr = 0
+        executor = None
+        try:
+            while True:
+                containers = self.containers_manager.get_containers(max_timestamp=max_timestamp)
+                if len(containers) > 0:
+                    self.timestamps_manager.set_min(min([c.timestamp for c in containers]))
+                    ships = self.ships_manager.get_available(max_timestamp=self.timestamps_manager.get_min())
+                    containers_by_height = {}
+                    for container in containers:
+                        containers_by_height.setdefault(container.height, []).append(container)
+                    if executor is None and self.workers != 1 and len(containers_by_height) > 1:
+                        prepare_shared_memory()
+                        executor = ProcessPoolExecutor(max_workers=self.workers)
+                    results = self.optimize_height_classes(ships, containers_by_height, max_timestamp,
+                                                           uncompleted_shipments, executor)
+
+                    for height, (shipment_manager, statistics, time_spent) in sorted(results.items()):
+                        if len(results) > 1:
+                            self.report_generator.log(f"Height class {height}:")
+                        self.report_generator.optimization_step(timestamp=max_timestamp,
+                                                                time_spent=time_spent,
+                                                                time_budget=self.time_budget,
+                                                                shipments_manager=shipment_manager,
+                                                                statistics=statistics)
+
+                        completed_shipments = shipment_manager.shipments[0:-1]
+                        uncompleted_shipment = shipment_manager.shipments[-1]
+                        if self.dwell_sla is not None and self.violates_sla(uncompleted_shipment, max_timestamp):
+                            self.report_generator.log(f"Uncompleted shipment dispatched "
+                                                      f"(dwell time SLA = {self.dwell_sla})")
+                            completed_shipments = shipment_manager.shipments
+                            uncompleted_shipment = None
+                        elif self.lookahead is not None and self.should_dispatch(uncompleted_shipment, max_timestamp):
+                            self.report_generator.log(f"Uncompleted shipment dispatched (lookahead = {self.lookahead})")
+                            completed_shipments = shipment_manager.shipments
+                            uncompleted_shipment = None
+                        containers_to_send = shipment_manager.get_containers(
+                            skip_last_shipment=uncompleted_shipment is not None)
+                        self.containers_manager.send(containers_to_send, timestamp=max_timestamp)
+                        self.report_generator.send_containers(timestamp=max_timestamp,
+                                                              available_ships=ships,
+                                                              completed_shipments=completed_shipments,
+                                                              uncompleted_shipment=uncompleted_shipment)
+                        if uncompleted_shipment is None:
+                            uncompleted_shipments.pop(height, None)
+                        else:
+                            uncompleted_shipments[height] = uncompleted_shipment
+
+                    next_timestamp = self.timestamps_manager.increase_max()
+                    if next_timestamp > -1:
+                        max_timestamp = next_timestamp
+                        completed_timestamps_nr += 1
+                        if self.checkpoint_dir is not None and completed_timestamps_nr % self.checkpoint_every == 0:
+                            self.save_checkpoint(max_timestamp)
+                    else:
+                        for height, uncompleted_shipment in sorted(uncompleted_shipments.items()):
+                            containers_to_send = uncompleted_shipment.get_all_containers()
+                            self.containers_manager.send(containers_to_send, timestamp=max_timestamp)
+                            self.report_generator.send_containers(timestamp=max_timestamp,
+                                                                  available_ships=ships,
+                                                                  completed_shipments=[uncompleted_shipment],
+                                                                  uncompleted_shipment=None)
+                        break
                 else:
-                    containers_to_send = uncompleted_shipment.get_all_containers()
-                    self.containers_manager.send(containers_to_send)
-                    self.report_generator.send_containers(timestamp=max_timestamp,
-                                                          available_ships=ships,
-                                                          completed_shipments=[uncompleted_shipment],
-                                                          uncompleted_shipment=None)
                     break
-            else:
-                break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            self.optimizer.close()
 
         self.report_generator.stop_optimization()
 
-    def run(self, input_file="input.txt", log_dir="log", log_file="log.txt", optimizer_algorithm=None):
+    def run(self, input_file="input.txt", log_dir="log", log_file="log.txt", optimizer_algorithm=None, if_print=True,
+            resume=False):
         """
         Main function.
         :param input_file: a file (name) with input data
         :param log_dir: a directory in which logs will be created
         :param log_file: a basename of a file to which logs will be written
         :param optimizer_algorithm: a proposed optimizer algorithm number
+        :param if_print: (bool) if print logs (they are always written to the log file)
+        :param resume: (bool) if continue from the last checkpoint (if there is one) instead of entering input data;
+                       logs are appended to the previous ones
         :return:
         """
-        with ReportGenerator(log_dir, log_file) as self.report_generator:
+        state = self.read_checkpoint() if resume else None
+        self.checkpoint_sent = (0, 0, 0)
+        with ReportGenerator(log_dir, log_file, if_print=if_print, if_clear=state is None) as self.report_generator:
             self.timestamps_manager = TimestampsManager()
             self.ships_manager = ShipsManager()
             self.containers_manager = ContainersManager()
 
-            self.optimizer = OptimizerSelector.select(self.select_optimizer_algorithm(optimizer_algorithm))
+            if state is None:
+                self.input_file = input_file
+                self.optimizer_algorithm = self.select_optimizer_algorithm(optimizer_algorithm)
+            else:
+                self.input_file = state["input_file"]
+                self.optimizer_algorithm = state["optimizer_algorithm"]
+            self.optimizer = OptimizerSelector.select(self.optimizer_algorithm, workers=self.optimizer_workers)
             self.report_generator.start(self.ships_manager, self.containers_manager, self.optimizer)
 
-            self.enter_data_from_file(input_file)
-            self.report_generator.data_summary(self.ships_manager, self.containers_manager)
+            if state is None:
+                self.enter_data_from_file(input_file)
+                self.report_generator.data_summary(self.ships_manager, self.containers_manager)
+            else:
+                self.load_checkpoint(state)
 
-            self.optimize()
-            self.report_generator.generate_report()
+            self.optimize(if_resumed=state is not None)
+            self.report_generator.generate_report(self.containers_manager)
+            self.remove_checkpoint()
 
             self.report_generator.stop()
 
 
+def test1():
+    import random
+    import tempfile
+    from data_generator import DataGenerator
+    # the lookahead policy never uses more ships than always holding the uncompleted shipment
+    with tempfile.TemporaryDirectory() as dirname:
+        input_file = os.path.join(dirname, "input.txt")
+        for seed in range(6):
+            random.seed(seed)
+            DataGenerator(containers_nr=60, ships_nr=4, timestamps_nr=6).rand_and_write(filename=input_file)
+            ships_nr = {}
+            for lookahead in (None, 1, 3):
+                operator = Operator(optimizer_algorithm_file=os.path.join(dirname, "optimizer_algorithm.txt"),
+                                    lookahead=lookahead, workers=1)
+                operator.run(input_file=input_file, log_dir=os.path.join(dirname, "log"), optimizer_algorithm=1,
+                             if_print=False)
+                ships_nr[lookahead] = len(operator.report_generator.shipments_list)
+            assert ships_nr[1] <= ships_nr[None] and ships_nr[3] <= ships_nr[None]
+
+
+def test2():
+    import random
+    import tempfile
+    from data_generator import DataGenerator
+
+    class Interrupted(Exception):
+        pass
+
+    class InterruptedOperator(Operator):
+        def save_checkpoint(self, max_timestamp):
+            super().save_checkpoint(max_timestamp)
+            if len(self.report_generator.shipments_list) > 0:
+                raise Interrupted()
+
+    # a run interrupted after a checkpoint and resumed sends the same shipments as an uninterrupted run
+    with tempfile.TemporaryDirectory() as dirname:
+        input_file = os.path.join(dirname, "input.txt")
+        algorithm_file = os.path.join(dirname, "optimizer_algorithm.txt")
+        checkpoint_dir = os.path.join(dirname, "checkpoint")
+        random.seed(0)
+        DataGenerator(containers_nr=80, ships_nr=6, timestamps_nr=8).rand_and_write(filename=input_file)
+        operator = Operator(optimizer_algorithm_file=algorithm_file, workers=1)
+        operator.run(input_file=input_file, log_dir=os.path.join(dirname, "log"), optimizer_algorithm=1,
+                     if_print=False)
+        shipments = [sh.describe() for sh in operator.report_generator.shipments_list]
+
+        operator = InterruptedOperator(optimizer_algorithm_file=algorithm_file, workers=1,
+                                       checkpoint_dir=checkpoint_dir)
+        try:
+            operator.run(input_file=input_file, log_dir=os.path.join(dirname, "log"), optimizer_algorithm=1,
+                         if_print=False)
+            assert False
+        except Interrupted:
+            pass
+        # a line appended by an interrupted saving of the next checkpoint is ignored
+        with open(os.path.join(checkpoint_dir, Operator.CHECKPOINT_SENT_FILE), "a") as f:
+            f.write('{"shipments": [], "sent_containers": []}\n')
+        operator = Operator(optimizer_algorithm_file=algorithm_file, workers=1, checkpoint_dir=checkpoint_dir)
+        operator.run(log_dir=os.path.join(dirname, "log"), if_print=False, resume=True)
+        assert [sh.describe() for sh in operator.report_generator.shipments_list] == shipments
+        assert os.listdir(checkpoint_dir) == []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the operator.")
+    parser.add_argument("--input", default="input_t4.txt", help="a file with input data")
+    parser.add_argument("--log-dir", default="log", help="a directory for logs")
+    parser.add_argument("--algorithm", type=int, default=None,
+                        help="an optimizer algorithm number (if not given, the previous one is used)")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="optimization time budget per timestamp in seconds")
+    parser.add_argument("--checkpoint-dir", default=None, help="a directory for checkpoints")
+    parser.add_argument("--checkpoint-every", type=int, default=1, help="number of timestamps between checkpoints")
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    args = parser.parse_args()
+    if args.resume and args.checkpoint_dir is None:
+        parser.error("--resume requires --checkpoint-dir")
+    operator = Operator(time_budget=args.time_budget, checkpoint_dir=args.checkpoint_dir,
+                        checkpoint_every=args.checkpoint_every)
+    operator.run(input_file=args.input, log_dir=args.log_dir, optimizer_algorithm=args.algorithm,
+                 resume=args.resume)
+
+
 if __name__ == "__main__":
-    operator = Operator()
-    operator.run(input_file="input_t4.txt")
+    main()
@@ -1,3 +1,5 @@
+import itertools
+
 from sortedcontainers import SortedList
 
 
@@ -109,6 +111,15 @@ class TimestampsManager:
         else:
             return -1
 
+    def get_next(self, x, k):
+        """
+        Get up to k timestamps greater than a given value.
+        :param x: timestamp
+        :param k: maximum number of returned timestamps
+        :return: list of timestamps
+        """
+        return list(itertools.islice(self.timestamps.irange(minimum=x, inclusive=(False, True)), k))
+
     def add(self, x):
         """
         Check if a given value is a correct timestamp